@@ -2,7 +2,7 @@ from flask import Flask, redirect, url_for
 from flask_login import current_user, LoginManager
 from config import Config
 from flask import request, url_for
-from extensions import db, csrf, migrate
+from extensions import db, csrf, migrate, OrjsonProvider
 from extensions import server_session as session_ext
 from flask_wtf.csrf import generate_csrf
 import os
@@ -12,14 +12,32 @@ from models import load_models
 def create_app():
     app = Flask(__name__, template_folder="templates")
     app.config.from_object(Config)
+    # JSON の入出力は orjson で処理する
+    app.json = OrjsonProvider(app)
+    # 添付アップロード API だけリクエスト全体の上限を設ける（超過分は Werkzeug がボディを読む前に 413 で拒否する）。
+    # プロジェクトの ZIP アップロード等には掛けない。CSRF 検証がフォームを読むより前に設定するため csrf より先に登録する
+    upload_files = {"docs.upload": app.config["MAX_UPLOAD_FILES"], "docs.upload_chunk": 1}
+
+    @app.before_request
+    def limit_upload_body():
+        files = upload_files.get(request.endpoint)
+        if files:
+            request.max_content_length = app.config["MAX_UPLOAD_BYTES"] * files
 
     db.init_app(app)
     csrf.init_app(app)
     migrate.init_app(app, db)
-    # Flask-Session（DBバックエンド）初期化
-    app.config.setdefault("SESSION_TYPE", "sqlalchemy")
-    app.config["SESSION_SQLALCHEMY"] = db
-    app.config.setdefault("SESSION_SQLALCHEMY_TABLE", "flask_sessions")
+    # Flask-Session 初期化（cachelib: ファイル / sqlalchemy: DB）
+    app.config.setdefault("SESSION_TYPE", "cachelib")
+    if app.config["SESSION_TYPE"] == "cachelib":
+        from cachelib.file import FileSystemCache
+        app.config.setdefault("SESSION_CACHELIB", FileSystemCache(
+            os.path.join(app.instance_path, "flask_sessions"),
+            threshold=10000,
+        ))
+    else:
+        app.config["SESSION_SQLALCHEMY"] = db
+        app.config.setdefault("SESSION_SQLALCHEMY_TABLE", "flask_sessions")
     app.config.setdefault("SESSION_USE_SIGNER", True)
     app.config.setdefault("SESSION_PERMANENT", True)
     session_ext.init_app(app)
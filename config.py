@@ -9,8 +9,24 @@ class Config:
         "sqlite:///replica.db" # instanceディレクトリの下に作られます
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    # ===== セッション（サーバサイド・DB）設定 =====
-    SESSION_TYPE = "sqlalchemy"
+    # エンジン設定（コンパイル済みSQLのキャッシュ拡大と接続の再利用）
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "query_cache_size": 1200,
+        "pool_pre_ping": True,
+    }
+    if SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
+        # SQLite はスレッド間で接続を使い回せるようにする（StaticPool は同時アクセスで壊れるため使わない）
+        SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {"check_same_thread": False}
+    else:
+        SQLALCHEMY_ENGINE_OPTIONS.update({
+            "pool_size": 10,
+            "max_overflow": 20,
+            "pool_recycle": 1800,
+        })
+    # ===== セッション（サーバサイド）設定 =====
+    # 既定は cachelib（instance/flask_sessions 配下のファイル）。リクエスト毎のSQLを発生させない
+    # 従来どおりDBに保存する場合は SESSION_TYPE=sqlalchemy を指定してください
+    SESSION_TYPE = os.environ.get("SESSION_TYPE", "cachelib")
     SESSION_USE_SIGNER = True
     SESSION_PERMANENT = True
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
@@ -19,6 +35,10 @@ class Config:
     # 本番運用時はHTTPS前提で有効化してください
     # SESSION_COOKIE_SECURE = True
 
+    # リバースプロキシ（Apache mod_xsendfile 等）配下では send_file の本体転送をプロキシへ任せる
+    # 例: USE_X_SENDFILE=1 （直接起動時は無効のままにしてください）
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE", "0").lower() in ("1", "true", "yes")
+
     # CSRF トークンの有効期限（24時間）
     WTF_CSRF_TIME_LIMIT = 60 * 60 * 24  # 24 hours
 
@@ -35,9 +55,11 @@ class Config:
         "docx,pptx,xlsx,pdf,"
         "py,js,ts,java,php,go,rb,cs,sh,sql,css"
     )
-    ALLOWED_UPLOAD_EXTS = [
+    ALLOWED_UPLOAD_EXTS = frozenset(
         ext.strip().lower() for ext in os.environ.get("ALLOWED_UPLOAD_EXTS", _default_allowed_exts).split(',') if ext.strip()
-    ]
+    )
 
     # 最大アップロードサイズ（バイト）
     MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))  # 10MB 既定
+    # 1リクエストで受け付ける最大ファイル数（添付アップロード API のボディ上限の算出に使用）
+    MAX_UPLOAD_FILES = int(os.environ.get("MAX_UPLOAD_FILES", 10))
@@ -1,12 +1,15 @@
 # controllers/__init__.py
 from flask import Flask
-from .users_controller import user_bp
-from .projects_controller import project_bp
-from .docs_controller import docs_bp
-from .knowledge_controller import knowledge_bp
 
 
 def register_blueprints(app: Flask):
+    # 各コントローラは create_app 時に初めて import する（import controllers だけで重い依存を読まない）
+    # ※ Flask は最初のリクエスト後の register_blueprint を禁止しているため、登録自体は起動時に行う
+    from .users_controller import user_bp
+    from .projects_controller import project_bp
+    from .docs_controller import docs_bp
+    from .knowledge_controller import knowledge_bp
+
     # これはめんどくさいので消したいところ。
     app.register_blueprint(user_bp, url_prefix="/users")
     # プロジェクトを作成する画面
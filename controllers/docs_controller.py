@@ -1,20 +1,26 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, stream_with_context, jsonify, send_file, abort
+from flask import Blueprint, render_template, request, redirect, url_for, flash, Response, stream_with_context, jsonify, send_file, abort, make_response, session
 from flask_login import login_required, current_user
 from forms.doc_form import DocForm
 from services.doc_service import DocService
-from services.gpt_provider import GptProvider
 from services.diff_service import DiffService
-from services.extract_service import ExtractService
+from services.extract_service import ExtractService, BINARY_EXTS
 from pathlib import Path
 import os
 import re
-import uuid
+import stat
+import gzip
+import hashlib
+import io
 import mimetypes
-from werkzeug.utils import secure_filename
+import orjson
+import time
+import zlib
+from functools import lru_cache
+from typing import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import current_app
 from services.project_service import ProjectService, ALLOWED_THEMES
-from services.image_prompt_service import ImagePromptService
 from services.image_service import ImageService
 
 
@@ -22,6 +28,26 @@ docs_bp = Blueprint("docs", __name__)
 
 from services.search_path_service import SearchPathService
 
+# 添付ファイルのテキスト抽出を並列に行う最大スレッド数
+ATTACHMENT_WORKERS = 8
+
+# これ未満のJSON応答は圧縮しない（バイト数）
+GZIP_MIN_BYTES = 1024
+
+# DocService は状態を持たないため、ワーカー内で1インスタンスを共有する
+docs_svc = DocService()
+project_svc = ProjectService()
+
+
+@lru_cache(maxsize=1)
+def _gpt_provider():
+    """GptProvider をワーカー内で1度だけ生成して使い回す（HTTP接続プールを維持するため）。
+    ChatOpenAI の初期化は API キーを要するので、import 時ではなく初回利用時に生成する。
+    LangChain/OpenAI の import も起動時ではなく初回利用時まで遅らせる。
+    """
+    from services.gpt_provider import GptProvider
+    return GptProvider()
+
 # ==========================
 # 生成ZIPの安全ダウンロード用（既存）
 # ==========================
@@ -70,57 +96,207 @@ def _safe_file_within_allowed_roots(abs_path: str | Path) -> Path:
     if not any(root in p.parents for root in roots):
         abort(400, description="invalid path")
     return p
+# ==========================
 # メディア（添付ファイル）関連
 # ==========================
 
+# 添付ファイルの保存ルート（起動時のカレントディレクトリ基準で1度だけ解決）
+_MEDIA_BASE = Path.cwd().resolve() / "media"
+
+
+@lru_cache(maxsize=1024)
 def _media_dir(project_id: int, user_id: int) -> Path:
-    """media/<user_id>/<project_id> を返す（無ければ作成）。"""
-    base = Path.cwd() / "media" / str(user_id) / str(project_id)
+    """media/<user_id>/<project_id> を返す（無ければ作成）。
+    作成済みのディレクトリはキャッシュし、2回目以降は mkdir を発行しない。
+    """
+    base = _MEDIA_BASE / str(user_id) / str(project_id)
     base.mkdir(parents=True, exist_ok=True)
     return base
 
 
+# 内容ハッシュ（抽出キャッシュのキー。改ざん検知用途ではないので高速な xxh3 を使う）
+try:
+    from xxhash import xxh3_128 as _content_hasher
+except ImportError:
+    _content_hasher = hashlib.sha256
+
+# 抽出結果のキャッシュ置き場（内容ハッシュ + 拡張子 + 上限文字数 をキーに保存）
+_EXTRACT_CACHE_DIR = _MEDIA_BASE / ".cache"
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    """ファイル内容のハッシュ（キャッシュキー用）。(パス, mtime, サイズ) が変わらない限り再計算しない。"""
+    h = _content_hasher()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _extract_cached(abs_path: Path, ext: str, limit: int, digest: str | None = None,
+                    st: os.stat_result | None = None) -> str:
+    """ExtractService.extract_text の結果を内容ハッシュ単位でディスクにキャッシュする。
+    digest が既知（保存時に計算済み）の場合はファイルを読み直さずにそれを使う。
+    st（呼び出し側で取得済みの stat 結果）があれば stat を再発行しない。
+    """
+    if digest is None:
+        try:
+            st = st or abs_path.stat()
+            digest = _file_digest(str(abs_path), st.st_mtime_ns, st.st_size)
+        except OSError:
+            return ExtractService.extract_text(abs_path, ext=ext, limit=limit)
+    cache_file = _EXTRACT_CACHE_DIR / f"{digest}_{ext}_{limit}.txt"
+    try:
+        return cache_file.read_text(encoding="utf-8")
+    except OSError:
+        pass
+    text = ExtractService.extract_text(abs_path, ext=ext, limit=limit)
+    try:
+        _EXTRACT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass
+    return text
+
+
 def _safe_media_file(p: str | Path, project_id: int, user_id: int) -> Path:
     """クライアントから渡されたパスが media/<user>/<project> 配下かを確認する。"""
-    path = Path(p).resolve()
-    root = _media_dir(project_id, user_id)
-    if not path.is_file():
+    return Path(_safe_media_stat(p, _media_dir(project_id, user_id))[0])
+
+
+def _safe_media_stat(p: str | Path, root: Path) -> tuple[str, os.stat_result]:
+    """
+    media ルート配下の通常ファイルかを検証し、(正規化済みパス, stat 結果) を返す。
+    文字列上の正規化で明らかな範囲外を先に弾き、realpath で途中のディレクトリのシンボリックリンクも解決して
+    ルート配下であることを確かめる。末尾がシンボリックリンクの場合も拒否する。
+    """
+    root_str = str(root)
+    path = os.path.normpath(os.path.join(root_str, os.fspath(p)))
+    if not path.startswith(root_str + os.sep):
+        abort(400, description="invalid media path")
+    # 途中の構成要素がシンボリックリンクでルート外を指していないか
+    if not os.path.realpath(path).startswith(root_str + os.sep):
+        abort(400, description="invalid media path")
+    try:
+        st = os.lstat(path)
+    except OSError:
         abort(404)
-    # ルートディレクトリに含まれているか
-    if root not in path.parents:
+    if stat.S_ISLNK(st.st_mode):
         abort(400, description="invalid media path")
-    return path
+    if not stat.S_ISREG(st.st_mode):
+        abort(404)
+    return path, st
 
 
 def _ext_ok(filename: str) -> bool:
     """拡張子チェック（元のファイル名から判定）"""
-    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    ext = os.path.splitext(filename)[1][1:].lower()
     if not ext:
         return False
-    allowed = set(current_app.config.get("ALLOWED_UPLOAD_EXTS", []))
-    return ext in allowed
+    return ext in _get_allowed_exts(current_app)
+
+
+def _get_allowed_exts(app) -> frozenset:
+    """ALLOWED_UPLOAD_EXTS を frozenset 化して app.extensions に保持する（設定がリストで上書きされていても1度だけ変換）。"""
+    exts = app.extensions.get("_allowed_exts_frozen")
+    if exts is None:
+        exts = frozenset(e.lower() for e in app.config.get("ALLOWED_UPLOAD_EXTS", ()))
+        app.extensions["_allowed_exts_frozen"] = exts
+    return exts
+
+
+# 保存名に使えない文字（ASCII英数字と . _ - 以外）をまとめて置換するための正規表現
+_UNSAFE_NAME_RE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def _safe_stem(stem: str) -> str:
+    """保存用のファイル名（拡張子なし）を1パスで安全化する。非ASCIIは '_' に置き換わる。"""
+    return _UNSAFE_NAME_RE.sub("_", stem).strip("._")[:128] or "file"
+
+
+def _save_upload(fs, abs_path: Path, max_bytes: int, head_bytes: int = 2048,
+                 chunk_size: int = 1024 * 1024) -> tuple[int | None, bytes, str]:
+    """
+    アップロードファイルをバイト数を数えながら保存し、(保存サイズ, 先頭 head_bytes バイト, 内容ハッシュ) を返す。
+    先頭バイトとハッシュは保存後にファイルを読み直さずに済むよう、書き込みと同じパスで求める。
+    max_bytes を超えた時点で書き込みを中断し、途中のファイルを削除して (None, b"", "") を返す。
+    """
+    total = 0
+    head = b""
+    h = _content_hasher()
+    with open(abs_path, "wb", buffering=chunk_size) as out:
+        while True:
+            chunk = fs.stream.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                break
+            if len(head) < head_bytes:
+                head += chunk[:head_bytes - len(head)]
+            h.update(chunk)
+            out.write(chunk)
+    if total > max_bytes:
+        try:
+            abs_path.unlink()
+        except OSError:
+            pass
+        return None, b"", ""
+    return total, head, h.hexdigest()
+
+
+def _new_media_path(media_dir: Path, orig_name: str) -> tuple[Path, str]:
+    """保存名を安全に生成し (保存先パス, 拡張子) を返す（拡張子は元のものを保持）。"""
+    ext_raw = orig_name.rsplit('.', 1)[-1].lower() if '.' in orig_name else ''
+    secure_stem = _safe_stem(Path(orig_name).stem)
+    uid = os.urandom(4).hex()
+    save_name = f"{uid}_{secure_stem}.{ext_raw}" if ext_raw else f"{uid}_{secure_stem}"
+    return media_dir / save_name, ext_raw
+
+
+def _upload_preview(abs_path: Path, ext_raw: str, head: bytes, digest: str | None = None) -> str:
+    """プレビュー用の抽出（拡張子に応じてテキスト抽出、最大500文字）。"""
+    try:
+        if ext_raw in BINARY_EXTS:
+            # Office/PDF のみ抽出器を通す（UTF-8 としてのフォールバックは行わない）
+            preview = _extract_cached(abs_path, ext_raw, 500, digest=digest)
+        else:
+            # テキスト系・未対応拡張子は保存時に確保した先頭バイトから作る（ファイルを読み直さない）
+            preview = head.decode('utf-8', errors='ignore')[:500]
+    except Exception:
+        preview = ''
+    # 生成時に渡す短縮版として保存しておく（use_full=false の場合に再抽出せず使う）
+    try:
+        sidecar = _preview_sidecar(abs_path)
+        sidecar.parent.mkdir(exist_ok=True)
+        sidecar.write_text(preview, encoding="utf-8")
+    except OSError:
+        pass
+    return preview
+
+
+def _preview_sidecar(abs_path: Path) -> Path:
+    """アップロード時プレビューの保存先（media/<user>/<project>/.preview/<保存名>.txt）。"""
+    return abs_path.parent / ".preview" / f"{abs_path.name}.txt"
+
+
+@docs_bp.errorhandler(413)
+def _too_large(e):
+    """MAX_CONTENT_LENGTH 超過時はアップロードAPIと同じ形式のJSONで返す。"""
+    return jsonify({"ok": False, "error": "too_large"}), 413
 
 
 @docs_bp.route("/<int:project_id>", methods=["GET", "POST"])
 @login_required
 def index(project_id: int):
     form = DocForm()
-    svc = DocService()
-
-    # 追加: プロジェクト名を取得
-    pj = ProjectService().fetch_by_id(project_id)
-    project_name = pj.project_name if pj else f"Project #{project_id}"
-    theme_class = getattr(pj, 'theme', 'theme-sky') if pj else 'theme-sky'
-    if theme_class not in ALLOWED_THEMES:
-        theme_class = 'theme-sky'
-
-    total = svc.count_by_project(project_id)
+    svc = docs_svc
 
-    pos = max(request.args.get("pos", 0, type=int) or 0, 0)
-    if total > 0:
-        pos = min(pos, total - 1)
-
-    if form.validate_on_submit() and form.submit_commit.data:
+    # POST（保存）は先に処理し、成功時は一覧系のクエリを発行せずにリダイレクトする
+    if request.method == "POST" and form.validate_on_submit() and form.submit_commit.data:
         content = (form.generated_content.data or "").strip()
         if not content:
             flash("生成結果が空です。先に『生成』してください。", "warning")
@@ -134,11 +310,33 @@ def index(project_id: int):
             flash("Docsを保存しました。", "success")
             return redirect(url_for("docs.index", project_id=project_id, pos=0))
 
-    current_commit = svc.nth_by_project(project_id, pos)
+    # 追加: プロジェクト名を取得（表示用メタ情報はキャッシュ済みのものを使う）
+    pj = project_svc.fetch_meta(project_id)
+    project_name = pj.project_name if pj else f"Project #{project_id}"
+    theme_class = getattr(pj, 'theme', 'theme-sky') if pj else 'theme-sky'
+    if theme_class not in ALLOWED_THEMES:
+        theme_class = 'theme-sky'
+
+    # N件目と総件数を1クエリで取得（範囲外の pos は最古に丸められる）
+    pos = max(request.args.get("pos", 0, type=int) or 0, 0)
+    current_commit, total, pos = svc.nth_with_total(project_id, pos)
     has_prev = (pos + 1) < total
     has_next = pos > 0
 
-    return render_template(
+    # GET では表示内容から ETag を作り、変化がなければテンプレートを描画せず 304 を返す
+    etag = None
+    if request.method == "GET" and "_flashes" not in session:
+        etag = _page_etag(
+            current_user.user_id, project_id, project_name, theme_class, total, pos,
+            current_commit.doc_id if current_commit else None,
+            current_commit.updated_at if current_commit else None,
+            _csrf_epoch(),
+            _csrf_digest(),
+        )
+        if request.if_none_match.contains_weak(etag):
+            return _not_modified(etag)
+
+    resp = make_response(render_template(
         "docs/index.html",
         form=form,
         project_id=project_id,
@@ -150,14 +348,54 @@ def index(project_id: int):
         has_next=has_next,
         total=total,
         theme_class=theme_class,
-    )
+    ))
+    if etag:
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        resp.vary.add("Cookie")
+    return resp
+
+
+def _page_etag(*parts) -> str:
+    """表示内容を決める値の組から ETag を作る。"""
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+def _csrf_epoch() -> int | None:
+    """
+    ページに埋め込む CSRF トークンの有効期限を跨いで 304 を返し続けないよう、
+    有効期限の半分ごとに ETag を変える。
+    """
+    limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600)
+    if not limit:
+        return None
+    return int(time.time() // max(int(limit) // 2, 1))
+
+
+def _csrf_digest() -> str | None:
+    """
+    ページにはセッションに紐づく CSRF トークンが埋め込まれるため、トークン（のハッシュ）も ETag に含める。
+    別セッションが古い If-None-Match を送っても 304 にならず、古いトークン入りのページを使い回させない。
+    """
+    raw = session.get(current_app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token"))
+    if not raw:
+        return None
+    return hashlib.sha1(str(raw).encode("utf-8")).hexdigest()
+
+
+def _not_modified(etag: str) -> Response:
+    resp = Response(status=304)
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    resp.vary.add("Cookie")
+    return resp
 
 @docs_bp.route("/save_note/<int:doc_id>", methods=["POST"])
 @login_required
 def save_note(doc_id):
     data = request.get_json()
     note = data.get('note')
-    svc = DocService()
+    svc = docs_svc
     if svc.save_note(doc_id, note):
         return jsonify({'success': True})
     return jsonify({'success': False}), 400
@@ -168,7 +406,7 @@ def save_note(doc_id):
 def upload(project_id: int):
     """
     必須拡張子＋Office/PDFを対象とした、ファイルアップロードAPI。
-    - 保存先: ./media/<user_id>/<project_id>/<uuid>_<secure_stem>.<ext>
+    - 保存先: ./media/<user_id>/<project_id>/<random8hex>_<secure_stem>.<ext>
     - 返却: { ok, files: [{name, size, ext, text_preview, stored_path}] }
     stored_path はクライアントに返すが、サーバ受信時に必ず media ルート配下か検証する。
     - プレビューは ExtractService で最大500文字を抽出（失敗時はUTF-8テキスト読みにフォールバック）。
@@ -188,44 +426,130 @@ def upload(project_id: int):
             results.append({"name": orig_name, "ok": False, "error": "unsupported_extension"})
             continue
 
-        # サイズチェック
-        fs.stream.seek(0, os.SEEK_END)
-        size = fs.stream.tell()
-        fs.stream.seek(0)
+        # サイズチェック（パートに Content-Length があれば保存前に判定）
         max_bytes = int(current_app.config.get("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
-        if size > max_bytes:
+        if fs.content_length and fs.content_length > max_bytes:
             results.append({"name": orig_name, "ok": False, "error": "too_large"})
             continue
 
-        # 保存名を安全に生成（拡張子は元のものを保持）
-        ext_raw = orig_name.rsplit('.', 1)[-1].lower() if '.' in orig_name else ''
-        secure_stem = secure_filename(Path(orig_name).stem) or 'file'
-        uid = uuid.uuid4().hex[:8]
-        save_name = f"{uid}_{secure_stem}.{ext_raw}" if ext_raw else f"{uid}_{secure_stem}"
-        abs_path = media_dir / save_name
-        fs.save(abs_path)
-
-        # プレビュー用の抽出（拡張子に応じてテキスト抽出）
-        try:
-            preview = ExtractService.extract_text(abs_path, ext=ext_raw, limit=500)
-            if not preview:
-                # フォールバック: プレーンテキストで最大500文字
-                preview = abs_path.read_text(encoding='utf-8', errors='ignore')[:500]
-        except Exception:
-            preview = ''
+        abs_path, ext_raw = _new_media_path(media_dir, orig_name)
+        size, head, digest = _save_upload(fs, abs_path, max_bytes)
+        if size is None:
+            results.append({"name": orig_name, "ok": False, "error": "too_large"})
+            continue
 
         results.append({
             "ok": True,
             "name": orig_name,
             "size": size,
             "ext": ext_raw,
-            "text_preview": preview,
+            "text_preview": _upload_preview(abs_path, ext_raw, head, digest),
             "stored_path": str(abs_path),
         })
 
     return jsonify({"ok": True, "files": results})
 
 
+_UPLOAD_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+# 分割アップロードの途中ファイルを放置とみなすまでの秒数
+CHUNK_PART_TTL = 24 * 60 * 60
+
+
+def _purge_stale_parts(chunk_dir: Path) -> None:
+    """最終更新から CHUNK_PART_TTL 秒を過ぎた途中ファイル（中断されたアップロード）を削除する。"""
+    cutoff = time.time() - CHUNK_PART_TTL
+    try:
+        with os.scandir(chunk_dir) as it:
+            for entry in it:
+                try:
+                    if entry.name.endswith(".part") and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                        os.unlink(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        pass
+
+
+@docs_bp.route("/upload_chunk/<int:project_id>", methods=["POST"])
+@login_required
+def upload_chunk(project_id: int):
+    """
+    分割・再開可能なアップロードAPI（1リクエスト = 1チャンク、ボディは生バイト列）。
+    - ヘッダ: Upload-Id（クライアント採番の英数字）, Content-Range: bytes <start>-<end>/<total>
+    - クエリ: ?name=<元のファイル名>
+    - 途中: { ok, done: false, range: "0-<end>" }（次は end+1 から送る）
+    - 最終チャンク: { ok, done: true, file: {name, size, ext, text_preview, stored_path} }
+    - 開始位置が受信済みサイズと一致しない場合は 409 と受信済み range を返す（再開用）。
+    """
+    orig_name = (request.args.get("name") or "").strip()
+    upload_id = request.headers.get("Upload-Id", "")
+    m = _CONTENT_RANGE_RE.match(request.headers.get("Content-Range", "").strip())
+    if not orig_name or not _UPLOAD_ID_RE.match(upload_id) or not m:
+        return jsonify({"ok": False, "error": "bad_request"}), 400
+
+    media_dir = _media_dir(project_id, current_user.user_id)
+    chunk_dir = media_dir / ".chunks"
+    chunk_dir.mkdir(exist_ok=True)
+    _purge_stale_parts(chunk_dir)
+    part = chunk_dir / f"{upload_id}.part"
+
+    # 続けても完了できないチャンクは、受信済みの途中ファイルごと破棄する
+    start, end, total = (int(x) for x in m.groups())
+    max_bytes = int(current_app.config.get("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+    if not _ext_ok(orig_name):
+        part.unlink(missing_ok=True)
+        return jsonify({"ok": False, "name": orig_name, "error": "unsupported_extension"}), 400
+    if total > max_bytes:
+        part.unlink(missing_ok=True)
+        return jsonify({"ok": False, "name": orig_name, "error": "too_large"}), 413
+    if end < start or end >= total:
+        part.unlink(missing_ok=True)
+        return jsonify({"ok": False, "error": "bad_range"}), 400
+
+    received = part.stat().st_size if part.exists() else 0
+    if start != received:
+        return jsonify({"ok": False, "error": "range_mismatch",
+                        "range": f"0-{received - 1}" if received else ""}), 409
+
+    expected = end - start + 1
+    written = 0
+    with open(part, "ab") as out:
+        while written < expected:
+            chunk = request.stream.read(min(1024 * 1024, expected - written))
+            if not chunk:
+                break
+            out.write(chunk)
+            written += len(chunk)
+    if written != expected:
+        # 途中で切れたチャンクは捨て、受信済み位置まで戻す
+        with open(part, "r+b") as f:
+            f.truncate(received)
+        return jsonify({"ok": False, "error": "incomplete_chunk",
+                        "range": f"0-{received - 1}" if received else ""}), 400
+
+    if end + 1 < total:
+        return jsonify({"ok": True, "done": False, "range": f"0-{end}"})
+
+    # 最終チャンク: 正式な保存名へ移動してプレビューを作る
+    abs_path, ext_raw = _new_media_path(media_dir, orig_name)
+    os.replace(part, abs_path)
+    with open(abs_path, "rb") as f:
+        head = f.read(2048)
+    return jsonify({
+        "ok": True,
+        "done": True,
+        "file": {
+            "ok": True,
+            "name": orig_name,
+            "size": total,
+            "ext": ext_raw,
+            "text_preview": _upload_preview(abs_path, ext_raw, head),
+            "stored_path": str(abs_path),
+        },
+    })
+
+
 @docs_bp.route("/<int:project_id>/image/prompt", methods=["POST"])
 @login_required
 def generate_image_prompt(project_id: int):
@@ -242,6 +566,7 @@ def generate_image_prompt(project_id: int):
     size = (data.get("size") or "768x768").strip()
     language = (data.get("language") or "ja").strip()
 
+    from services.image_prompt_service import ImagePromptService
     svc = ImagePromptService()
     res = svc.generate(user_prompt=user_prompt, preset=preset, size=size, language=language)
 
@@ -272,7 +597,7 @@ def generate_image(project_id: int):
 
     dest_dir = _media_dir(project_id, current_user.user_id) / "images"
     dest_dir.mkdir(parents=True, exist_ok=True)
-    filename = f"{uuid.uuid4().hex[:12]}.{ext}"
+    filename = f"{os.urandom(6).hex()}.{ext}"
     abs_path = dest_dir / filename
     abs_path.write_bytes(img_bytes)
 
@@ -297,47 +622,70 @@ def view_image(project_id: int):
         return abort(400, description="path required")
     path = _safe_media_file(p, project_id, current_user.user_id)
     mime, _ = mimetypes.guess_type(str(path))
-    return send_file(path, mimetype=mime or None)
+    # conditional=True: If-None-Match / If-Modified-Since には 304 を返す
+    return send_file(path, mimetype=mime or None, conditional=True)
 
 
-def _build_attachments_text(project_id: int, user_id: int, paths: list[str], per_file_limit: int = 100_000) -> str:
+def _build_attachments_text(project_id: int, user_id: int, paths: list[str], per_file_limit: int = 100_000,
+                            use_full: bool = True) -> str:
     """
     添付された media 内のファイルを安全に読み、LLMへ渡すテキストを構築する。
     - 各ファイル先頭 per_file_limit 文字まで（ExtractServiceでテキスト抽出）
+    - use_full=False の場合はアップロード時のプレビュー（最大500文字）を使い、再抽出しない
     - 章区切りとして "---" とファイル名ラベルを付与
     """
     if not paths:
         return ""
-    parts: list[str] = []
-    for p in paths:
+    root = _media_dir(project_id, user_id)
+
+    def _one(p: str) -> tuple[str, str] | None:
         try:
-            abs_path = _safe_media_file(p, project_id, user_id)
-            name = abs_path.name
-            ext = abs_path.suffix.lower().lstrip('.')
-            snippet = ExtractService.extract_text(abs_path, ext=ext, limit=per_file_limit)
-            parts.append(f"\n\n---\n[添付ファイル:{name}]\n{snippet}")
+            path_str, st = _safe_media_stat(p, root)
+            abs_path = Path(path_str)
+            name = os.path.basename(path_str)
+            ext = os.path.splitext(name)[1][1:].lower()
+            snippet = None
+            if not use_full:
+                try:
+                    snippet = _preview_sidecar(abs_path).read_text(encoding="utf-8")
+                except OSError:
+                    pass
+            if snippet is None:
+                snippet = _extract_cached(abs_path, ext, per_file_limit, st=st)
+            return name, snippet
         except Exception:
             # 読み取りに失敗したファイルはスキップ
+            return None
+
+    if len(paths) == 1:
+        parts = [_one(paths[0])]
+    else:
+        # ファイルごとの抽出は独立しているので並列に行う（結果は入力順で連結）
+        with ThreadPoolExecutor(max_workers=min(ATTACHMENT_WORKERS, len(paths))) as ex:
+            parts = list(ex.map(_one, paths))
+    # 抽出結果（最大 per_file_limit 文字）を f-string で複製せず、1つのバッファへ直接書き込む
+    buf = io.StringIO()
+    for part in parts:
+        if part is None:
             continue
-    return "".join(parts)
+        buf.write("\n\n---\n[添付ファイル:")
+        buf.write(part[0])
+        buf.write("]\n")
+        buf.write(part[1])
+    return buf.getvalue()
 
 
 @docs_bp.route("/<int:project_id>/delete/<int:memo_id>", methods=["POST"])
 @login_required
 def delete_history(project_id: int, memo_id: int):
-    svc = DocService()
+    svc = docs_svc
     svc.delete_history(project_id, memo_id)
 
     left_pos  = max(request.args.get("left_pos", 0, type=int) or 0, 0)
     right_pos = max(request.args.get("right_pos", 1, type=int) or 0, 0)
 
-    total = svc.count_by_project(project_id)
-    if total > 0:
-        left_pos  = min(left_pos,  total - 1)
-        right_pos = min(right_pos, total - 1)
-
-    current_left  = svc.nth_by_project(project_id, left_pos)
-    current_right = svc.nth_by_project(project_id, right_pos)
+    # 左右の位置と総件数を1クエリで取得（範囲外の位置は最古に丸められる）
+    total, (left_pos, right_pos), (current_left, current_right) = svc.page_state(project_id, [left_pos, right_pos])
     left_has_prev  = (left_pos + 1)  < total
     left_has_next  = left_pos > 0
     right_has_prev = (right_pos + 1) < total
@@ -357,6 +705,33 @@ def delete_history(project_id: int, memo_id: int):
     )
 
 
+def _accepts_gzip() -> bool:
+    return request.accept_encodings["gzip"] > 0
+
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """バイト列のストリームを gzip 形式で逐次圧縮する。"""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def _gzip_response(resp: Response) -> Response:
+    """クライアントが gzip を受け付ける場合、（ストリームでない）JSON応答の本体を圧縮する。"""
+    resp.vary.add("Accept-Encoding")
+    if resp.direct_passthrough or resp.is_streamed or not _accepts_gzip():
+        return resp
+    data = resp.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return resp
+    resp.set_data(gzip.compress(data, 6))
+    resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
+
 @docs_bp.route("/<int:project_id>/stream_tool", methods=["POST"])
 @login_required
 def stream_generate_tool(project_id: int):
@@ -367,11 +742,13 @@ def stream_generate_tool(project_id: int):
         return jsonify({"error": "prompt is required"}), 400
 
     # 添付（media配下のファイル）を読み込み、プロンプトにサーバ側で追記
-    att_text = _build_attachments_text(project_id, current_user.user_id, attachments)
+    # use_full=false を指定すると、アップロード時のプレビューだけを添付として渡す
+    att_text = _build_attachments_text(project_id, current_user.user_id, attachments,
+                                       use_full=data.get("use_full") is not False)
     final_prompt = prompt + att_text
 
-    provider = GptProvider()
-    svc = DocService()
+    provider = _gpt_provider()
+    svc = docs_svc
 
     def generate():
         yield ""
@@ -393,9 +770,7 @@ def latest_diff(project_id: int):
     未設定/不正/非Git の場合はエラーJSON（カレントへのフォールバックはしない）。
     クエリ ?staged=1 でステージ済み差分。
     """
-    from services.project_service import ProjectService
-    ps = ProjectService()
-    proj = ps.fetch_by_id(project_id)
+    proj = project_svc.fetch_by_id(project_id)
     if not proj or not getattr(proj, 'doc_path', None):
         return jsonify({"ok": False, "error": "doc_path_not_set", "message": "このプロジェクトのdoc_pathが設定されていません。プロジェクト詳細で設定してください。"}), 400
 
@@ -407,33 +782,44 @@ def latest_diff(project_id: int):
 
     svc = DiffService(base_dir=base_dir)
     try:
-        files = svc.latest_git_diffs(staged=staged, include_untracked=True, max_files=100)
+        # 作業ツリーが前回から変わっていなければ diff を計算せずに 304 を返す
+        etag = svc.worktree_fingerprint(staged=staged)
+        if request.if_none_match.contains_weak(etag):
+            return _not_modified(etag)
+        files = svc.iter_git_diffs(staged=staged, include_untracked=True, max_files=100)
     except ValueError as e:
         err = str(e)
         if err == 'not_a_git_repo':
             return jsonify({"ok": False, "error": err, "message": ".git が見つかりません。doc_path は Git リポジトリである必要があります。"}), 400
         return jsonify({"ok": False, "error": err, "message": "git diff の取得に失敗しました。"}), 400
 
-    payload = {
-        "ok": True,
-        "project_id": project_id,
-        "files": [
-            {
+    def generate():
+        # パッチ全体をリストに溜めず、1ファイルずつ JSON 化して送る
+        yield b'{"ok":true,"project_id":%d,"files":[' % project_id
+        sep = b""
+        for f in files:
+            yield sep + orjson.dumps({
                 "path": f.path,
                 "status": f.status,
                 "patch": f.patch,
                 "size": f.size,
                 "truncated": f.truncated,
-            }
-            for f in files
-        ],
-    }
-    return jsonify(payload)
+            })
+            sep = b","
+        yield b"]}"
+
+    body = generate()
+    headers = {"Vary": "Accept-Encoding", "ETag": f'W/"{etag}"', "Cache-Control": "private, no-cache"}
+    if _accepts_gzip():
+        # パッチやパスは繰り返しが多く、gzip でよく縮む
+        body = _gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(body), mimetype="application/json", headers=headers)
 
 @docs_bp.route("/<int:project_id>/search_paths", methods=["GET"])
 @login_required
 def search_paths(project_id: int):
-    pj = ProjectService().fetch_by_id(project_id)
+    pj = project_svc.fetch_meta(project_id)
     if not pj or not getattr(pj, 'doc_path', None):
         flash("このプロジェクトのdoc_pathが設定されていません。プロジェクト詳細で設定してください。", "warning")
         return redirect(url_for('docs.index', project_id=project_id))
@@ -448,12 +834,31 @@ def search_paths(project_id: int):
 def search_tree(project_id: int):
     try:
         rel = (request.args.get('rel') or '').strip()
-        tree = SearchPathService().build_tree(project_id, rel=rel)
-        return jsonify(tree)
+        sp_svc = SearchPathService()
+        # ツリーを作る前にディレクトリの mtime から ETag を求め、変化がなければ走査せずに 304 を返す
+        etag = sp_svc.tree_fingerprint(project_id, rel=rel)
+        if request.if_none_match.contains_weak(etag):
+            return _not_modified(etag)
+        resp = jsonify(sp_svc.build_tree(project_id, rel=rel))
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return _gzip_response(resp)
     except ValueError as e:
         return jsonify({"ok": False, "error": str(e)}), 400
 
 
+# パス区切りの \\ を / に寄せる変換表
+_BACKSLASH_TABLE = str.maketrans({"\\": "/"})
+
+
+def _norm_rel_paths(items) -> list[str]:
+    """クライアントから来た相対パス配列を正規化する（区切りを / に統一し、前後の / を除去）。"""
+    if not isinstance(items, list):
+        return []
+    out = (x.strip().translate(_BACKSLASH_TABLE).strip("/") for x in items if isinstance(x, str))
+    return list(dict.fromkeys(x for x in out if x))
+
+
 @docs_bp.route("/<int:project_id>/search_paths_state", methods=["GET", "POST"])
 @login_required
 def search_paths_state(project_id: int):
@@ -464,8 +869,8 @@ def search_paths_state(project_id: int):
     data = request.get_json(silent=True) or {}
     includes = data.get('includes') or []
     excludes = data.get('excludes') or []
-    # 正規化（文字列配列のみ許可）
-    inc = [str(x).strip().replace('\\\\', '/').strip('/') for x in includes if isinstance(x, (str,))]
-    exc = [str(x).strip().replace('\\\\', '/').strip('/') for x in excludes if isinstance(x, (str,))]
+    # 正規化（文字列配列のみ許可、重複は除去）
+    inc = _norm_rel_paths(includes)
+    exc = _norm_rel_paths(excludes)
     saved = SearchPathService().save_state(project_id, inc, exc)
     return jsonify({"ok": True, **saved})
@@ -1,4 +1,3 @@
-import json
 from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_required
 from flask_login import current_user
@@ -10,6 +9,8 @@ knowledge_bp = Blueprint('knowledge', __name__)
 
 from services.project_service import ProjectService, ALLOWED_THEMES
 
+project_svc = ProjectService()
+
 @knowledge_bp.route('/api/create_from_prompt', methods=['POST'])
 @login_required
 def api_create_from_prompt():
@@ -32,7 +33,7 @@ def api_create_from_prompt():
 @login_required
 def index(project_id):
     knowledge = KnowledgeService.get_all_by_project(project_id)
-    pj = ProjectService().fetch_by_id(project_id)
+    pj = project_svc.fetch_meta(project_id)
     project_name = pj.project_name if pj else f"Project #{project_id}"
     theme_class = getattr(pj, 'theme', 'theme-sky') if pj else 'theme-sky'
     if theme_class not in ALLOWED_THEMES:
@@ -45,7 +46,7 @@ def index(project_id):
 @login_required
 def create(project_id):
     form = KnowledgeForm()
-    pj = ProjectService().fetch_by_id(project_id)
+    pj = project_svc.fetch_meta(project_id)
     project_name = pj.project_name if pj else f"Project #{project_id}"
     theme_class = getattr(pj, 'theme', 'theme-sky') if pj else 'theme-sky'
     if theme_class not in ALLOWED_THEMES:
@@ -62,7 +63,7 @@ def create(project_id):
 def edit(project_id, knowledge_id):
     knowledge = KnowledgeService.get(knowledge_id)
     form = KnowledgeForm(obj=knowledge)
-    pj = ProjectService().fetch_by_id(project_id)
+    pj = project_svc.fetch_meta(project_id)
     project_name = pj.project_name if pj else f"Project #{project_id}"
     theme_class = getattr(pj, 'theme', 'theme-sky') if pj else 'theme-sky'
     if theme_class not in ALLOWED_THEMES:
@@ -1,5 +1,5 @@
 # project_controller.py
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, g
 from services.project_service import ProjectService, ALLOWED_THEMES
 from forms.project_form import ProjectRegisterForm
 from flask_login import login_required
@@ -7,11 +7,20 @@ from extensions import csrf
 
 project_bp = Blueprint("projects", __name__)
 
+# ProjectService は状態を持たない（セッションは db.session）ので、ワーカーごとに1つを使い回す
+project_svc = ProjectService()
+
+def _all_projects():
+    """プロジェクト一覧をリクエスト内で1度だけ取得する（g にメモ化）。"""
+    if "_all_projects" not in g:
+        g._all_projects = project_svc.fetch_all_projects()
+    return g._all_projects
+
+
 @project_bp.route("/", methods=["GET"])
 @login_required
 def index():
-    pj_sv = ProjectService()
-    projects = pj_sv.fetch_all_projects()
+    projects = _all_projects()
     return render_template("projects/index.html", projects=projects)
 
 # 新規作成
@@ -20,8 +29,7 @@ def index():
 def create():
     form = ProjectRegisterForm()
     if form.validate_on_submit():
-        pj_sv = ProjectService()
-        pj_sv.create_project(
+        project_svc.create_project(
             project_name=form.project_name.data,
             description=form.description.data,
             doc_path=form.doc_path.data,
@@ -34,13 +42,17 @@ def create():
 @project_bp.route("/<int:project_id>/edit", methods=["GET", "POST"])
 @login_required
 def edit(project_id: int):
-    pj_sv = ProjectService()
-    project = pj_sv.fetch_by_id(project_id)
+    project = project_svc.fetch_by_id(project_id)
     if not project:
         flash("対象のプロジェクトが見つかりません。", "warning")
         return redirect(url_for("projects.index"))
 
-    form = ProjectRegisterForm(obj=project)
+    # obj= だとフォームの全フィールドについて getattr で探すため、必要な値だけを data= で渡す
+    form = ProjectRegisterForm(data={
+        "project_name": project.project_name,
+        "description": project.description,
+        "doc_path": project.doc_path,
+    })
 
     if form.validate_on_submit():
         # ZIPがアップロードされているか確認
@@ -48,12 +60,12 @@ def edit(project_id: int):
         extracted_path = None
         if file and file.filename:
             try:
-                extracted_path = pj_sv.save_and_extract_doc_zip(file, project_id)
+                extracted_path = project_svc.save_and_extract_doc_zip(file, project_id)
             except Exception as e:
                 flash(f"ZIPの処理に失敗しました: {e}", "danger")
                 return render_template("projects/form.html", form=form, mode="edit", project=project)
 
-        pj_sv.update_project(
+        project_svc.update_project(
             project_id=project.project_id,
             project_name=form.project_name.data,
             description=form.description.data,
@@ -73,7 +85,7 @@ def duplicate_project(project_id):
         return redirect(url_for('projects.index'))
 
     try:
-        ProjectService.duplicate_project(project_id, new_name)
+        project_svc.duplicate_project(project_id, new_name)
         flash('プロジェクトを複製しました', 'success')
     except ValueError as e:
         flash(str(e), 'error')
@@ -84,7 +96,7 @@ def duplicate_project(project_id):
 @login_required
 def delete_project(project_id):
     try:
-        ProjectService.delete_project(project_id)
+        project_svc.delete_project(project_id)
         flash('プロジェクトを削除しました', 'success')
     except ValueError as e:
         flash(str(e), 'error')
@@ -100,7 +112,7 @@ def update_theme(project_id: int):
     if theme not in ALLOWED_THEMES:
         return jsonify({"ok": False, "error": "invalid_theme"}), 400
     try:
-        proj = ProjectService().update_theme(project_id, theme)
+        proj = project_svc.update_theme(project_id, theme)
         return jsonify({"ok": True, "project_id": project_id, "theme": proj.theme})
     except ValueError as e:
         return jsonify({"ok": False, "error": str(e)}), 400
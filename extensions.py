@@ -2,8 +2,42 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 from flask_migrate import Migrate
 from flask_session import Session
+from flask.json.provider import DefaultJSONProvider
+import orjson
 
 db = SQLAlchemy()
 csrf = CSRFProtect()
 migrate = Migrate()
 server_session = Session()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """request.get_json() / jsonify を orjson で処理する JSON プロバイダ。
+    datetime/dataclass などは Flask 既定と同じ表現になるよう _default に委ねる。
+    dumps/loads に追加引数が渡された場合は標準 json にフォールバックする。
+    """
+
+    _OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def _dump_bytes(self, obj, *, indent: bool = False) -> bytes:
+        opts = self._OPTS
+        if self.sort_keys:
+            opts |= orjson.OPT_SORT_KEYS
+        if indent:
+            opts |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=opts)
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._dump_bytes(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._dump_bytes(obj, indent=indent) + b"\n", mimetype=self.mimetype)
@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError
-from models.users import Users
+from services.user_service import UserService
 
 class RegistrationForm(FlaskForm):
     username = StringField('ユーザー名', validators=[DataRequired()])
@@ -12,13 +12,12 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('登録')
 
     def validate_username(self, username):
-        user = Users.query.filter_by(username=username.data).first()
-        if user is not None:
+        # 存在確認だけなので行は取得せず EXISTS で判定する（結果は短時間キャッシュ）
+        if UserService.username_taken(username.data):
             raise ValidationError('このユーザー名は既に使用されています。')
 
     def validate_email(self, email):
-        user = Users.query.filter_by(email=email.data).first()
-        if user is not None:
+        if UserService.email_taken(email.data):
             raise ValidationError('このメールアドレスは既に使用されています。')
 
 class LoginForm(FlaskForm):
@@ -4,12 +4,15 @@ from extensions import db
 class Projects(db.Model):
     __tablename__ = "projects"
     project_id       = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id    = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=True)
+    user_id    = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=True, index=True)
     project_name = db.Column(db.String(255), nullable=False, unique=True)
     description = db.Column(db.String(1024), nullable=True, unique=False)
     doc_path = db.Column(db.String(260), nullable=True, unique=False)
     # 追加: プロジェクトごとのテーマ（3パターンのキーを保存）
     theme = db.Column(db.String(32), nullable=False, default='theme-sky')
 
+    # 暗黙の遅延ロード（N+1）は例外にする。必要な箇所で selectinload 等を明示すること
+    user = db.relationship("Users", back_populates="projects", lazy="raise")
+
     def __repr__(self):
         return f"<Project {self.project_name}>"
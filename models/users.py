@@ -1,8 +1,21 @@
 # models/user.py
+import hashlib
+import threading
+import time
+
 from extensions import db
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# check_password の検証結果キャッシュ（KDF は意図的に遅いので、短時間の再認証で何度も回さない）
+# - キーは (user_id, password_hash, sha256(入力)) で、平文は保持しない
+# - 成功した結果だけを覚える（誤ったパスワードの試行は毎回 KDF を通すので総当たりは安くならない）
+# - password_hash をキーに含めるため、パスワード変更で古いエントリは自然に無効になる
+VERIFY_CACHE_TTL = 60
+VERIFY_CACHE_MAX = 512
+_verify_cache: dict = {}
+_verify_lock = threading.Lock()
+
 
 class Users(db.Model):
     __tablename__ = 'users'
@@ -14,13 +27,32 @@ class Users(db.Model):
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, server_default=db.func.now(), onupdate=db.func.now())
 
+    # Projects.user の逆側（暗黙の遅延ロードは例外にする）
+    projects = db.relationship("Projects", back_populates="user", lazy="raise")
+
     def set_password(self, password):
         """パスワードをハッシュ化して保存します。"""
         self.password_hash = generate_password_hash(password)
+        with _verify_lock:
+            for k in [k for k in _verify_cache if k[0] == self.user_id]:
+                del _verify_cache[k]
 
     def check_password(self, password):
         """入力されたパスワードがハッシュと一致するかを確認します。"""
-        return check_password_hash(self.password_hash, password)
+        key = (self.user_id, self.password_hash, hashlib.sha256(password.encode("utf-8")).digest())
+        now = time.monotonic()
+        with _verify_lock:
+            expires = _verify_cache.get(key)
+            if expires is not None and expires > now:
+                return True
+        ok = check_password_hash(self.password_hash, password)
+        if ok:
+            with _verify_lock:
+                if len(_verify_cache) >= VERIFY_CACHE_MAX:
+                    for k in [k for k, v in _verify_cache.items() if v <= now] or list(_verify_cache)[:VERIFY_CACHE_MAX // 4]:
+                        del _verify_cache[k]
+                _verify_cache[key] = now + VERIFY_CACHE_TTL
+        return ok
 
     def get_id(self):
         """ユーザーの一意のIDを返します。"""
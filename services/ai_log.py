@@ -1,11 +1,154 @@
 from __future__ import annotations
-import json
 import os
+import queue
 import threading
+import time
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+import orjson
+
+
+class _LogWriter:
+    """
+    全 AiRunLogger で共有する書き込みスレッド。
+    呼び出し側は行をキューに積むだけで、実際の write/flush はまとめて（最大 BATCH_MAX 行 / FLUSH_INTERVAL 秒ごと）行う。
+    """
+
+    BATCH_MAX = 64
+    FLUSH_INTERVAL = 0.25
+
+    def __init__(self):
+        self._q: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="ai-log-writer", daemon=True)
+                t.start()
+                self._thread = t
+
+    def put(self, fp, line) -> None:
+        self.put_many(((fp, line),))
+
+    def put_many(self, items) -> None:
+        """(fp, 行) の組をまとめて1回でキューに積む（.log と .jsonl の両方へ書くイベント用）。"""
+        self._ensure_started()
+        self._q.put(tuple(items))
+
+    def flush(self, fps, timeout: float = 5.0) -> None:
+        """fps に積まれた行を書き出して flush する（書き込みスレッド側で終わるまで待つ）。"""
+        self._control(fps, False, timeout)
+
+    def close(self, fps, timeout: float = 5.0) -> None:
+        """fps に積まれた行を書き終えてから閉じる（書き込みスレッド側で閉じるまで待つ）。"""
+        self._control(fps, True, timeout)
+
+    def _control(self, fps, close: bool, timeout: float) -> None:
+        self._ensure_started()
+        done = threading.Event()
+        self._q.put(((None, (fps, close, done)),))
+        done.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            # flush/close 要求が来たら待たずに書き出す
+            while len(batch) < self.BATCH_MAX and batch[-1][0][0] is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    @staticmethod
+    def _flush_pending(pending: Dict[Any, list]) -> None:
+        # flush はしない（バッファが溜まったときと end_session / close 時にまとめて書き出される）
+        for fp, lines in pending.items():
+            try:
+                fp.writelines(lines)
+            except Exception:
+                pass
+        pending.clear()
+
+    def _write_batch(self, batch) -> None:
+        pending: Dict[Any, list] = {}
+        for fp, item in (pair for items in batch for pair in items):
+            if fp is not None:
+                pending.setdefault(fp, []).append(item)
+                continue
+            fps, close, done = item
+            self._flush_pending(pending)
+            for f in fps:
+                try:
+                    if close:
+                        f.close()
+                    else:
+                        f.flush()
+                except Exception:
+                    pass
+            done.set()
+        self._flush_pending(pending)
+
+
+_writer = _LogWriter()
+
+# レダクション対象のキーと、文字列値の最大長
+SENSITIVE_KEYS = frozenset({"api_key", "apikey", "authorization", "Authorization", "token", "access_token", "password", "secret"})
+REDACT_MAX_CHARS = 4000
+# ログファイルのバッファサイズ（追記モードなので書き出しは O_APPEND で行われる）
+LOG_BUFFER_BYTES = 64 * 1024
+
+
+def _needs_redact(obj: Any) -> bool:
+    """マスク対象のキー、または長すぎる文字列を含むかを（再帰せずに）調べる。"""
+    stack = [obj]
+    while stack:
+        v = stack.pop()
+        if isinstance(v, dict):
+            if not SENSITIVE_KEYS.isdisjoint(v.keys()):
+                return True
+            stack.extend(v.values())
+        elif isinstance(v, list):
+            stack.extend(v)
+        elif isinstance(v, str) and len(v) > REDACT_MAX_CHARS:
+            return True
+    return False
+
+
+def _redact_copy(obj: Any) -> Any:
+    """dict/list を複製しながらマスクする（明示スタックで走査）。"""
+    root = [obj]
+    stack = [(root, 0)]
+    while stack:
+        container, key = stack.pop()
+        v = container[key]
+        if isinstance(v, dict):
+            out: Dict[Any, Any] = {}
+            for k, x in v.items():
+                if k in SENSITIVE_KEYS:
+                    out[k] = "*****"
+                else:
+                    out[k] = x
+                    stack.append((out, k))
+            container[key] = out
+        elif isinstance(v, list):
+            out_list = list(v)
+            container[key] = out_list
+            stack.extend((out_list, i) for i in range(len(out_list)))
+        elif isinstance(v, str) and len(v) > REDACT_MAX_CHARS:
+            container[key] = v[:REDACT_MAX_CHARS] + "...(truncated)"
+    return root[0]
+
 
 class AiRunLogger:
     """
@@ -29,91 +172,98 @@ class AiRunLogger:
         self.project_id = project_id
         self.run_id = run_id or datetime.now().strftime("%Y%m%d-%H%M%S")
         self.base_dir = base_dir or f"instance/{project_id}/ai_logs"
-        self._lock = threading.Lock()
         self._fp_text = None
         self._fp_json = None
+        self._ts_cache = (-1, "", "")
         if self.enabled:
             Path(self.base_dir).mkdir(parents=True, exist_ok=True)
-            self._fp_text = open(os.path.join(self.base_dir, f"{self.run_id}.log"), "a", encoding="utf-8")
-            self._fp_json = open(os.path.join(self.base_dir, f"{self.run_id}.jsonl"), "a", encoding="utf-8")
+            self._fp_text = open(os.path.join(self.base_dir, f"{self.run_id}.log"), "a", encoding="utf-8", buffering=LOG_BUFFER_BYTES)
+            self._fp_json = open(os.path.join(self.base_dir, f"{self.run_id}.jsonl"), "ab", buffering=LOG_BUFFER_BYTES)
 
     # ---- 基本I/O ----
+    def _stamps(self) -> tuple:
+        """(秒, テキスト用, ISO) の時刻文字列。同じ秒の間は整形済みの値を使い回す。"""
+        sec = int(time.time())
+        if sec != self._ts_cache[0]:
+            now = datetime.fromtimestamp(sec)
+            self._ts_cache = (sec, now.strftime("%Y/%m/%d %H:%M:%S"), now.isoformat(timespec="seconds"))
+        return self._ts_cache
+
     def _ts(self) -> str:
-        return datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        return self._stamps()[1]
 
     def _iso(self) -> str:
-        return datetime.now().isoformat(timespec="seconds")
+        return self._stamps()[2]
 
     def _redact(self, obj: Any) -> Any:
         """簡易レダクション: 機微なキーや長すぎるトークンらしき値をマスク。"""
-        SENSITIVE_KEYS = {"api_key", "apikey", "authorization", "Authorization", "token", "access_token", "password", "secret"}
-        try:
-            if isinstance(obj, dict):
-                out: Dict[str, Any] = {}
-                for k, v in obj.items():
-                    if k in SENSITIVE_KEYS:
-                        out[k] = "*****"
-                    else:
-                        out[k] = self._redact(v)
-                return out
-            elif isinstance(obj, list):
-                return [self._redact(v) for v in obj]
-            elif isinstance(obj, str):
-                if len(obj) > 4000:
-                    return obj[:4000] + "...(truncated)"
-                return obj
-            else:
-                return obj
-        except Exception:
+        if not _needs_redact(obj):
+            # 大半のイベントはマスク対象を含まないので、そのまま返す（コピーしない）
             return obj
+        return _redact_copy(obj)
+
+    def _json_line(self, event_type: str, payload: Dict[str, Any]) -> bytes:
+        # payload は呼び出し後に変更されうるため、シリアライズまではこのスレッドで行う
+        safe = self._redact(payload)
+        rec = {"ts": self._iso(), "type": event_type, **safe}
+        return orjson.dumps(rec, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
 
     def _write_text(self, line: str) -> None:
         if not self.enabled or not self._fp_text:
             return
-        with self._lock:
-            self._fp_text.write(line + "\n")
-            self._fp_text.flush()
+        _writer.put(self._fp_text, line + "\n")
 
     def _write_jsonl(self, event_type: str, payload: Dict[str, Any]) -> None:
         if not self.enabled or not self._fp_json:
             return
-        with self._lock:
-            safe = self._redact(payload)
-            rec = {"ts": self._iso(), "type": event_type, **safe}
-            self._fp_json.write(json.dumps(rec, ensure_ascii=False) + "\n")
-            self._fp_json.flush()
+        _writer.put(self._fp_json, self._json_line(event_type, payload))
+
+    def _emit(self, text_line: str, event_type: str, payload: Dict[str, Any]) -> None:
+        """テキストと JSONL の両方へ書くイベントを、1回のキュー投入でまとめて渡す。"""
+        if not self.enabled:
+            return
+        items = []
+        if self._fp_text:
+            items.append((self._fp_text, text_line + "\n"))
+        if self._fp_json:
+            items.append((self._fp_json, self._json_line(event_type, payload)))
+        if items:
+            _writer.put_many(items)
 
     # ---- API ----
     def start_session(self, meta: Dict[str, Any]) -> None:
-        self._write_text(f"[{self._ts()}] [SESSION-START] project={self.project_id} run_id={self.run_id}")
-        self._write_jsonl("session_start", {"project_id": self.project_id, "run_id": self.run_id, "meta": meta})
+        self._emit(f"[{self._ts()}] [SESSION-START] project={self.project_id} run_id={self.run_id}",
+                   "session_start", {"project_id": self.project_id, "run_id": self.run_id, "meta": meta})
 
     def end_session(self, status: str = "ok", summary: Optional[str] = None) -> None:
-        self._write_text(f"[{self._ts()}] [SESSION-END] status={status} summary={summary or ''}")
-        self._write_jsonl("session_end", {"status": status, "summary": summary})
+        self._emit(f"[{self._ts()}] [SESSION-END] status={status} summary={summary or ''}",
+                   "session_end", {"status": status, "summary": summary})
+        # セッションの結果行は close を待たずにファイルへ出しておく
+        self.flush()
 
     def info(self, msg: str, extra: Optional[Dict[str, Any]] = None) -> None:
-        self._write_text(f"[{self._ts()}] [INFO] {msg}")
         if extra:
-            self._write_jsonl("info", {"msg": msg, "extra": extra})
+            self._emit(f"[{self._ts()}] [INFO] {msg}", "info", {"msg": msg, "extra": extra})
+        else:
+            self._write_text(f"[{self._ts()}] [INFO] {msg}")
 
     def error(self, msg: str, exc: Optional[BaseException] = None, extra: Optional[Dict[str, Any]] = None) -> None:
-        self._write_text(f"[{self._ts()}] [ERROR] {msg} {exc or ''}")
-        self._write_jsonl("error", {"msg": msg, "exception": str(exc) if exc else None, "extra": extra or {}})
+        self._emit(f"[{self._ts()}] [ERROR] {msg} {exc or ''}",
+                   "error", {"msg": msg, "exception": str(exc) if exc else None, "extra": extra or {}})
 
     def messages_initial(self, messages: Any) -> None:
         self._write_jsonl("messages_initial", {"count": len(messages) if hasattr(messages, '__len__') else None, "messages": messages})
 
     def turn_start(self, turn: int, conversation_len: int) -> None:
-        self._write_text(f"[{self._ts()}] [TURN {turn} START] conversation_len={conversation_len}")
-        self._write_jsonl("turn_start", {"turn": turn, "conversation_len": conversation_len})
+        self._emit(f"[{self._ts()}] [TURN {turn} START] conversation_len={conversation_len}",
+                   "turn_start", {"turn": turn, "conversation_len": conversation_len})
 
     def ai_raw(self, turn: int, content: Any, tool_calls_preview: Optional[Any] = None) -> None:
         self._write_jsonl("ai_raw", {"turn": turn, "content": content, "tool_calls": tool_calls_preview or []})
 
     def tool_call(self, turn: int, name: str, args: Dict[str, Any], call_id: Optional[str] = None) -> None:
-        self._write_text(f"[{self._ts()}] [TOOL CALL] {name}")
-        self._write_jsonl("tool_call", {"turn": turn, "name": name, "args": args, "call_id": call_id})
+        self._emit(f"[{self._ts()}] [TOOL CALL] {name}",
+                   "tool_call", {"turn": turn, "name": name, "args": args, "call_id": call_id})
 
     def tool_result(self, turn: int, call_id: Optional[str], result: Any) -> None:
         self._write_jsonl("tool_result", {"turn": turn, "call_id": call_id, "result": result})
@@ -121,11 +271,14 @@ class AiRunLogger:
     def final_text(self, text: Any) -> None:
         self._write_jsonl("final_text", {"text": text})
 
+    def flush(self) -> None:
+        fps = [fp for fp in (self._fp_text, self._fp_json) if fp]
+        if fps:
+            _writer.flush(fps)
+
     def close(self) -> None:
-        try:
-            if self._fp_text:
-                self._fp_text.close()
-            if self._fp_json:
-                self._fp_json.close()
-        except Exception:
-            pass
+        fps = [fp for fp in (self._fp_text, self._fp_json) if fp]
+        self._fp_text = None
+        self._fp_json = None
+        if fps:
+            _writer.close(fps)
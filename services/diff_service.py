@@ -1,10 +1,53 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, Tuple
 import re
+import os
+import stat
 import difflib
+import hashlib
 import subprocess
+import threading
+import time
+
+
+# git の core.quotepath（既定）と同じ規則でパスをクォートする
+_C_ESCAPES = {7: "a", 8: "b", 9: "t", 10: "n", 11: "v", 12: "f", 13: "r", 34: '"', 92: "\\"}
+_C_UNESCAPES = {v: k for k, v in _C_ESCAPES.items()}
+
+
+def _quote_c_style(name: str) -> str:
+    raw = name.encode("utf-8", errors="surrogateescape")
+    if not any(b < 0x20 or b >= 0x7F or b in (34, 92) for b in raw):
+        return name
+    out = []
+    for b in raw:
+        if b in _C_ESCAPES:
+            out.append("\\" + _C_ESCAPES[b])
+        elif b < 0x20 or b >= 0x7F:
+            out.append("\\%03o" % b)
+        else:
+            out.append(chr(b))
+    return '"' + "".join(out) + '"'
+
+
+def _unquote_c_style(quoted: str) -> str:
+    s = quoted[1:-1]
+    out = bytearray()
+    i = 0
+    while i < len(s):
+        c = s[i]
+        if c != "\\":
+            out += c.encode("utf-8")
+            i += 1
+        elif s[i + 1:i + 2] in _C_UNESCAPES:
+            out.append(_C_UNESCAPES[s[i + 1]])
+            i += 2
+        else:
+            out.append(int(s[i + 1:i + 4], 8))
+            i += 4
+    return out.decode("utf-8", errors="ignore")
 
 
 @dataclass
@@ -23,6 +66,14 @@ class DiffService:
 
     BK_PATTERN = re.compile(r"^(?P<ts>\d{14})bk_(?P<name>.+)$")
 
+    # まとめて git diff するときの1回あたりのパス引数の文字数上限（Windows のコマンドライン長対策）
+    GIT_ARGS_MAX_CHARS = 8000
+    _DIFF_HEADER_RE = re.compile(r"^diff --git ", re.MULTILINE)
+    # base_dir -> (取得時刻, 作業ツリーのルート, index ファイル)
+    REPO_PATHS_TTL = 60.0
+    _repo_paths_cache: Dict[str, Tuple[float, Path, Path]] = {}
+    _repo_paths_lock = threading.Lock()
+
     def __init__(self, base_dir: Optional[Path] = None, project_id: Optional[int] = None):
         """
         base_dir が明示されていない場合は project_id を用いて Projects.doc_path から探索ルートを解決する。
@@ -172,6 +223,80 @@ class DiffService:
         if rc != 0 or (out.strip().lower() != "true"):
             raise ValueError("not_a_git_repo")
 
+    def _check_git_result(self, rc: int, err: str, label: str, ok_codes: Tuple[int, ...] = (0,)) -> None:
+        """
+        git の実行結果を確認する。リポジトリかどうかは事前に調べず、失敗したときだけ
+        _ensure_git_repo で判定して not_a_git_repo を優先して返す（正常系で git の起動を1回減らす）。
+        """
+        if rc in ok_codes:
+            return
+        self._ensure_git_repo()
+        raise ValueError(f"{label}: {err.strip() or rc}")
+
+    def _repo_paths(self) -> Tuple[Path, Path]:
+        """
+        (作業ツリーのルート, index ファイル) を返す。doc_path がリポジトリのサブディレクトリでも正しく解決する。
+        リポジトリの場所はほぼ変わらないため、短時間キャッシュする。
+        """
+        key = str(self.base_dir)
+        now = time.monotonic()
+        with self._repo_paths_lock:
+            hit = self._repo_paths_cache.get(key)
+        if hit is not None and now - hit[0] < self.REPO_PATHS_TTL:
+            return hit[1], hit[2]
+        rc, out, err = self._run_git("rev-parse", "--show-toplevel", "--git-path", "index")
+        self._check_git_result(rc, err, "git_rev_parse_failed")
+        lines = out.splitlines()
+        top = Path(lines[0])
+        # --git-path は cwd からの相対（または絶対）パスで返る
+        index = self.base_dir / lines[1]
+        with self._repo_paths_lock:
+            self._repo_paths_cache[key] = (now, top, index)
+        return top, index
+
+    def worktree_fingerprint(self, *, staged: bool = False) -> str:
+        """
+        差分内容が変わったかを判定するための指紋（ETag 用）。パッチは生成しない。
+        HEAD・git status の出力・変更ファイルと index の mtime/サイズから算出する。
+        status のパスはリポジトリのルートからの相対なので、ルート基準で stat する。
+        """
+        # --no-optional-locks: status による index の書き換え（= 指紋の変化）を避ける
+        # --branch: HEAD のコミット（# branch.oid）も同じ出力に含める
+        rc, out, err = self._run_git(
+            "--no-optional-locks", "status", "--porcelain=v2", "--branch", "-z", "--untracked-files=all"
+        )
+        self._check_git_result(rc, err, "git_status_failed")
+        top, index = self._repo_paths()
+        h = hashlib.sha1()
+        h.update(f"{int(staged)}\0".encode("utf-8"))
+        h.update(out.encode("utf-8"))
+        targets: List[Tuple[str, Path]] = [("\0index", index)]
+        entries = out.split("\x00")
+        i = 0
+        while i < len(entries):
+            rec = entries[i]
+            i += 1
+            kind = rec[:1]
+            if kind == "1":
+                rel = rec.split(" ", 8)[-1]
+            elif kind == "2":  # rename/copy は元パスが次のトークンに続く
+                rel = rec.split(" ", 9)[-1]
+                i += 1
+            elif kind == "u":
+                rel = rec.split(" ", 10)[-1]
+            elif kind == "?":
+                rel = rec[2:]
+            else:
+                continue
+            targets.append((rel, top / rel))
+        for rel, path in targets:
+            try:
+                st = os.stat(path)
+                h.update(f"{rel}\0{st.st_mtime_ns}\0{st.st_size}\0".encode("utf-8"))
+            except OSError:
+                h.update(f"{rel}\0-\0".encode("utf-8"))
+        return h.hexdigest()
+
     def latest_git_diffs(
         self,
         *,
@@ -184,15 +309,32 @@ class DiffService:
         Git の差分を取得して返す。既定では作業ツリーの未ステージ差分、staged=True でステージ済み差分。
         未追跡ファイルは include_untracked=True のときに /dev/null との比較として擬似パッチを生成する。
         """
-        self._ensure_git_repo()
+        return list(self.iter_git_diffs(
+            staged=staged,
+            include_untracked=include_untracked,
+            max_files=max_files,
+            max_patch_bytes=max_patch_bytes,
+        ))
 
+    def iter_git_diffs(
+        self,
+        *,
+        staged: bool = False,
+        include_untracked: bool = True,
+        max_files: int = 200,
+        max_patch_bytes: int = 500_000,
+    ) -> Iterator[DiffFile]:
+        """
+        latest_git_diffs の逐次版。変更ファイル一覧の取得（失敗時の ValueError を含む）はこの呼び出し時点で行い、
+        パッチは返したイテレータを最初に進めたときにまとめて取得する。
+        """
         # 変更ファイル一覧（ステータス付き）
         diff_args = ["diff", "--name-status", "-z"]
         if staged:
             diff_args.insert(1, "--staged")
         rc, out, err = self._run_git(*diff_args)
-        if rc not in (0, 1):  # git diff は差分ありで 1 を返すことがある
-            raise ValueError(f"git_diff_failed: {err.strip() or rc}")
+        # git diff は差分ありで 1 を返すことがある
+        self._check_git_result(rc, err, "git_diff_failed", ok_codes=(0, 1))
 
         entries = [s for s in out.split("\x00") if s]
         changed: List[Tuple[str, str, Optional[str]]] = []  # (status, path, optional new_path)
@@ -254,8 +396,19 @@ class DiffService:
             seen.add((p, "??"))
             files_to_collect.append(("??", p, None))
 
-        results: List[DiffFile] = []
-        for st, p, old in files_to_collect[:max_files]:
+        return self._iter_git_patches(files_to_collect[:max_files], staged=staged, max_patch_bytes=max_patch_bytes)
+
+    def _iter_git_patches(
+        self,
+        files_to_collect: List[Tuple[str, str, Optional[str]]],
+        *,
+        staged: bool,
+        max_patch_bytes: int,
+    ) -> Iterator[DiffFile]:
+        # 追跡ファイルのパッチはまとめて1回（引数が長い場合は数回）の git diff で取得する
+        tracked = self._batch_git_patches([p for st, p, _ in files_to_collect if st != "??"], staged=staged)
+
+        for st, p, old in files_to_collect:
             status_norm = {
                 "M": "modified",
                 "A": "added",
@@ -269,45 +422,127 @@ class DiffService:
             size = 0
 
             if st == "??":
-                # /dev/null との比較で擬似パッチを生成（git diff --no-index）
-                rc_p, out_p, _ = self._run_git("diff", "--no-index", "--patch", "--", "/dev/null", p)
-                if rc_p in (0, 1):
-                    patch_text = out_p
-                else:
-                    patch_text = f"--- /dev/null\n+++ b/{p}\n+<unavailable>"
+                # /dev/null との比較の擬似パッチ（通常ファイルは git を起動せずに生成する）
+                patch_text = self._untracked_patch(p)
+                if patch_text is None:
+                    rc_p, out_p, _ = self._run_git("diff", "--no-index", "--patch", "--", "/dev/null", p)
+                    if rc_p in (0, 1):
+                        patch_text = out_p
+                    else:
+                        patch_text = f"--- /dev/null\n+++ b/{p}\n+<unavailable>"
                 fpath = (self.base_dir / p)
                 try:
                     size = fpath.stat().st_size
                 except Exception:
                     size = 0
             else:
-                # 個別パッチ取得（--staged は必要に応じて）
-                args = ["diff"]
-                if staged:
-                    args.append("--staged")
-                args += ["--patch", "--", p]
-                rc_p, out_p, err_p = self._run_git(*args)
-                if rc_p in (0, 1):
-                    patch_text = out_p
-                else:
-                    patch_text = f"--- a/{p}\n+++ b/{p}\n-<unavailable>\n+<unavailable>\n"
+                patch_text = tracked.get(p)
+                if patch_text is None:
+                    # まとめた出力から切り出せなかったもの（rename 等）は個別に取得
+                    args = ["diff"]
+                    if staged:
+                        args.append("--staged")
+                    args += ["--patch", "--", p]
+                    rc_p, out_p, err_p = self._run_git(*args)
+                    if rc_p in (0, 1):
+                        patch_text = out_p
+                    else:
+                        patch_text = f"--- a/{p}\n+++ b/{p}\n-<unavailable>\n+<unavailable>\n"
                 try:
                     size = (self.base_dir / p).stat().st_size
                 except Exception:
                     size = 0
 
-            if len(patch_text.encode("utf-8")) > max_patch_bytes:
-                # 大きすぎるパッチは先頭だけ残す
-                enc = patch_text.encode("utf-8")[:max_patch_bytes]
-                patch_text = enc.decode("utf-8", errors="ignore") + "\n...<truncated>..."
-                truncated = True
+            # UTF-8 は1文字最大4バイトなので、文字数×4 が上限以下なら encode せずに済ませる
+            if len(patch_text) * 4 > max_patch_bytes:
+                enc = patch_text.encode("utf-8")
+                if len(enc) > max_patch_bytes:
+                    # 大きすぎるパッチは先頭だけ残す
+                    patch_text = enc[:max_patch_bytes].decode("utf-8", errors="ignore") + "\n...<truncated>..."
+                    truncated = True
 
-            results.append(DiffFile(
+            yield DiffFile(
                 path=p,
                 status=status_norm,
                 patch=patch_text,
                 size=size,
                 truncated=truncated,
-            ))
+            )
 
-        return results
+    def _batch_git_patches(self, paths: List[str], *, staged: bool) -> Dict[str, str]:
+        """
+        複数パスの git diff を少ない起動回数で取得し、パス -> パッチ に分割して返す。
+        ヘッダから新旧同一のパスを特定できないブロック（rename 等）は含めない。
+        """
+        result: Dict[str, str] = {}
+        base = ["diff", "--staged", "--patch", "--"] if staged else ["diff", "--patch", "--"]
+        batch: List[str] = []
+        chars = 0
+        for i, p in enumerate(paths):
+            batch.append(p)
+            chars += len(p) + 1
+            if chars < self.GIT_ARGS_MAX_CHARS and i < len(paths) - 1:
+                continue
+            rc, out, _ = self._run_git(*base, *batch, timeout=30)
+            batch, chars = [], 0
+            if rc not in (0, 1):
+                continue
+            starts = [m.start() for m in self._DIFF_HEADER_RE.finditer(out)]
+            for j, at in enumerate(starts):
+                block = out[at:starts[j + 1] if j + 1 < len(starts) else len(out)]
+                path = self._header_path(block[len("diff --git "):block.find("\n")])
+                if path is not None:
+                    result[path] = block
+        return result
+
+    @staticmethod
+    def _header_path(rest: str) -> Optional[str]:
+        """「a/X b/X」（クォート時は「"a/X" "b/X"」）形式のヘッダからパスを返す。新旧が異なれば None。"""
+        if len(rest) % 2 == 0:
+            return None
+        half = len(rest) // 2
+        a, sep, b = rest[:half], rest[half], rest[half + 1:]
+        if sep != " ":
+            return None
+        if a.startswith('"'):
+            if a[:3] != '"a/' or b[:3] != '"b/' or a[3:] != b[3:]:
+                return None
+            return _unquote_c_style(a)[2:]
+        if a[:2] != "a/" or b[:2] != "b/" or a[2:] != b[2:]:
+            return None
+        return a[2:]
+
+    def _untracked_patch(self, rel: str) -> Optional[str]:
+        """
+        git diff --no-index /dev/null <rel> と同じ形式のパッチを Python で生成する。
+        通常ファイル以外（シンボリックリンク等）や読めない場合は None（呼び出し側で git に任せる）。
+        """
+        fpath = self.base_dir / rel
+        try:
+            st = os.lstat(fpath)
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            data = fpath.read_bytes()
+        except OSError:
+            return None
+        mode = "100755" if (os.name != "nt" and st.st_mode & stat.S_IXUSR) else "100644"
+        blob = hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()[:7]
+        a_name, b_name = _quote_c_style(f"a/{rel}"), _quote_c_style(f"b/{rel}")
+        head = f"diff --git {a_name} {b_name}\nnew file mode {mode}\nindex 0000000..{blob}\n"
+        if not data:
+            return head
+        if b"\0" in data[:8000]:
+            return head + f"Binary files /dev/null and {b_name} differ\n"
+        lines = data.split(b"\n")
+        no_eol = lines[-1] != b""
+        if not no_eol:
+            lines.pop()
+        n = len(lines)
+        body = b"".join(b"+" + ln + b"\n" for ln in lines)
+        if no_eol:
+            body += b"\\ No newline at end of file\n"
+        hunk = f"@@ -0,0 +1 @@\n" if n == 1 else f"@@ -0,0 +1,{n} @@\n"
+        # git は空白を含むパスの ---/+++ 行の末尾に TAB を付ける
+        tab = "\t" if " " in b_name else ""
+        # UTF-8 でないテキスト（Shift_JIS 等）も内容を落とさないよう、不正バイトは置換文字にする
+        return head + f"--- /dev/null\n+++ {b_name}{tab}\n" + hunk + body.decode("utf-8", errors="replace")
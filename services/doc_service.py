@@ -1,12 +1,25 @@
 # services/design_memo_service.py
+import threading
+import time
 from typing import List, Optional
+from sqlalchemy import func, select
 from extensions import db
 from models.docs import Docs
 
 class DocService(object):
+    # 件数キャッシュ（project_id -> (取得時刻, 件数)）。commit/delete で破棄する
+    COUNT_CACHE_TTL = 30.0
+    _count_cache: dict[int, tuple[float, int]] = {}
+    _count_lock = threading.Lock()
+
     def __init__(self):
         pass
 
+    @classmethod
+    def _invalidate_count(cls, project_id: int) -> None:
+        with cls._count_lock:
+            cls._count_cache.pop(project_id, None)
+
     def latest_by_project(self, project_id: int) -> Optional[Docs]:
         return (Docs.query
                 .filter(Docs.project_id == project_id)
@@ -15,9 +28,17 @@ class DocService(object):
 
     # 追加: 件数
     def count_by_project(self, project_id: int) -> int:
-        return (Docs.query
-                .filter(Docs.project_id == project_id)
-                .count())
+        now = time.monotonic()
+        with self._count_lock:
+            hit = self._count_cache.get(project_id)
+        if hit is not None and now - hit[0] < self.COUNT_CACHE_TTL:
+            return hit[1]
+        total = (Docs.query
+                 .filter(Docs.project_id == project_id)
+                 .count())
+        with self._count_lock:
+            self._count_cache[project_id] = (now, total)
+        return total
 
     # 追加: N件目を取得（0=最新, 1=ひとつ前, ...）
     def nth_by_project(self, project_id: int, n: int) -> Optional[Docs]:
@@ -34,6 +55,59 @@ class DocService(object):
             doc.note = doc.note or ''
         return doc
 
+    # 追加: N件目と総件数を1クエリで取得（COUNT(*) OVER ()）
+    def nth_with_total(self, project_id: int, n: int) -> tuple[Optional[Docs], int, int]:
+        """
+        (N件目の Docs, 総件数, 実際の位置) を返す。
+        n が範囲外の場合は最古の1件（total - 1）に丸めて取り直す。
+        """
+        total, positions, docs = self.page_state(project_id, [n])
+        return docs[0], total, positions[0]
+
+    # 追加: 複数位置の Docs と総件数を1クエリで取得（ROW_NUMBER() / COUNT(*) OVER ()）
+    def page_state(self, project_id: int, positions: List[int]) -> tuple[int, List[int], List[Optional[Docs]]]:
+        """
+        (総件数, 丸め後の位置リスト, 各位置の Docs リスト) を返す。
+        範囲外の位置は最古の1件（total - 1）に丸める（その場合のみ追加で1クエリ発行）。
+        """
+        positions = [max(n, 0) for n in positions]
+        total, found = self._rows_at(project_id, positions)
+        if total is None:
+            # 要求位置がすべて範囲外（または0件）: 件数を取り直して丸める
+            total = self.count_by_project(project_id)
+        clamped = [min(n, total - 1) if total > 0 else 0 for n in positions]
+        missing = [n for n in clamped if total > 0 and n not in found]
+        if missing:
+            _, more = self._rows_at(project_id, missing)
+            found.update(more)
+        with self._count_lock:
+            self._count_cache[project_id] = (time.monotonic(), total)
+        docs: List[Optional[Docs]] = []
+        for n in clamped:
+            doc = found.get(n)
+            if doc is not None:
+                # NoteがNoneの場合は空文字列に変換
+                doc.note = doc.note or ''
+            docs.append(doc)
+        return total, clamped, docs
+
+    def _rows_at(self, project_id: int, positions: List[int]) -> tuple[Optional[int], dict[int, Docs]]:
+        """positions（0=最新）にある行と総件数を1クエリで取得する。該当行が無ければ総件数は None。"""
+        ranked = (db.session.query(
+                      Docs.doc_id.label("doc_id"),
+                      func.row_number().over(order_by=Docs.committed_at.desc()).label("rn"),
+                      func.count().over().label("total"),
+                  )
+                  .filter(Docs.project_id == project_id)
+                  .subquery())
+        rows = (db.session.query(Docs, ranked.c.rn, ranked.c.total)
+                .join(ranked, Docs.doc_id == ranked.c.doc_id)
+                .filter(ranked.c.rn.in_([n + 1 for n in set(positions)]))
+                .all())
+        if not rows:
+            return None, {}
+        return rows[0][2], {rn - 1: doc for doc, rn, _ in rows}
+
     def commit(self, *, project_id: int, user_id: Optional[int], prompt: str,
                content: str) -> Docs:
         memo = Docs(
@@ -44,6 +118,7 @@ class DocService(object):
         )
         db.session.add(memo)
         db.session.commit()
+        self._invalidate_count(project_id)
         return memo
 
     def fetch_history(self, project_id: int, limit: Optional[int] = 20, newest_first: bool = False) -> list[Docs]:
@@ -58,10 +133,24 @@ class DocService(object):
             q = q.limit(limit)
         rows = q.all()  # ここでは新しい→古い
 
-        if newest_first:
-            return rows
-        # 既定は古い→新しい（会話順に自然）
-        return list(reversed(rows))
+        if not newest_first:
+            # 既定は古い→新しい（会話順に自然）
+            rows.reverse()
+        return rows
+
+    def fetch_history_pairs(self, project_id: int, limit: Optional[int] = 20) -> list[tuple[str, str]]:
+        """
+        会話履歴を (prompt, content) の組で古い→新しいの順に返す。
+        プロンプト組み立て用で、Docs インスタンスは作らず2列だけを取得する。
+        """
+        stmt = (select(Docs.prompt, Docs.content)
+                .where(Docs.project_id == project_id)
+                .order_by(Docs.committed_at.desc()))
+        if limit:
+            stmt = stmt.limit(limit)
+        rows = db.session.execute(stmt).all()  # ここでは新しい→古い
+        rows.reverse()
+        return rows
 
     def delete_history(self, project_id: int, memo_id: int) -> bool:
         memo = Docs.query.filter_by(doc_id=memo_id, project_id=project_id).first()
@@ -69,6 +158,7 @@ class DocService(object):
             return False
         db.session.delete(memo)
         db.session.commit()
+        self._invalidate_count(project_id)
         return True
 
     # 追加: プロンプトと回答を連動して取得
@@ -76,7 +166,7 @@ class DocService(object):
         return self.nth_by_project(project_id, pos)
 
     def save_note(self, doc_id, note):
-        doc = Docs.query.get(doc_id)
+        doc = db.session.get(Docs, doc_id)
         if not doc:
             return False
         doc.note = note
@@ -16,10 +16,21 @@ services/extract_service.py
 - PDFはレイアウトが崩れることがある。OCRは別途実装（オプション）。
 """
 
+import io
 from pathlib import Path
 from typing import Optional
 
 
+# プレーンテキストとして読むだけでよい拡張子
+TEXT_EXTS = frozenset({
+    "txt", "md", "markdown", "csv", "json", "yaml", "yml", "html", "htm",
+    "py", "js", "ts", "java", "php", "go", "rb", "cs", "sh", "sql", "css",
+})
+
+# 専用の抽出処理が必要なバイナリ形式（UTF-8 として読んではいけない）
+BINARY_EXTS = frozenset({"docx", "pptx", "xlsx", "pdf"})
+
+
 def _safe_str(s: Optional[str]) -> str:
     return s or ""
 
@@ -39,9 +50,8 @@ class ExtractService:
 
         text = ""
         try:
-            if ext in {"txt", "md", "markdown", "csv", "json", "yaml", "yml", "html", "htm",
-                       "py", "js", "ts", "java", "php", "go", "rb", "cs", "sh", "sql", "css"}:
-                text = p.read_text(encoding="utf-8", errors="ignore")
+            if ext in TEXT_EXTS:
+                text = ExtractService._read_text_head(p, limit)
             elif ext == "docx":
                 text = ExtractService._extract_docx(p)
             elif ext == "pptx":
@@ -60,6 +70,14 @@ class ExtractService:
             return text[:limit]
         return text
 
+    @staticmethod
+    def _read_text_head(p: Path, limit: Optional[int]) -> str:
+        """テキストを読む。limit 指定時は必要な分（UTF-8 は1文字最大4バイト）だけ読む。"""
+        if limit is None or limit <= 0:
+            return p.read_text(encoding="utf-8", errors="ignore")
+        with p.open("rb") as f:
+            return f.read(limit * 4).decode("utf-8", errors="ignore")
+
     @staticmethod
     def _extract_docx(p: Path) -> str:
         try:
@@ -68,10 +86,7 @@ class ExtractService:
             return ""
         try:
             doc = Document(str(p))
-            parts = []
-            for para in doc.paragraphs:
-                parts.append(para.text)
-            return "\n".join(filter(None, parts))
+            return "\n".join(t for para in doc.paragraphs if (t := para.text))
         except Exception:
             return ""
 
@@ -87,11 +102,11 @@ class ExtractService:
             for slide in prs.slides:
                 for shape in slide.shapes:
                     try:
-                        if hasattr(shape, "text"):
-                            parts.append(_safe_str(shape.text))
+                        if hasattr(shape, "text") and (t := _safe_str(shape.text)):
+                            parts.append(t)
                     except Exception:
                         continue
-            return "\n".join(filter(None, parts))
+            return "\n".join(parts)
         except Exception:
             return ""
 
@@ -103,16 +118,25 @@ class ExtractService:
             return ""
         try:
             wb = openpyxl.load_workbook(str(p), read_only=True, data_only=True)
-            parts = []
+        except Exception:
+            return ""
+        try:
+            # 行ごとの文字列をリストに溜めず、StringIO へ直接書き出す（行間は改行、末尾には付けない）
+            buf = io.StringIO()
+            sep = ""
             for ws in wb.worksheets:
-                parts.append(f"# Sheet: {ws.title}")
+                buf.write(f"{sep}# Sheet: {ws.title}")
+                sep = "\n"
                 for row in ws.iter_rows(values_only=True):
                     # タブ区切りで1行に整形
-                    cells = ["" if v is None else str(v) for v in row]
-                    parts.append("\t".join(cells))
-            return "\n".join(parts)
+                    buf.write(sep)
+                    buf.write("\t".join(["" if v is None else str(v) for v in row]))
+            return buf.getvalue()
         except Exception:
             return ""
+        finally:
+            # read_only モードはファイルを開いたままにするので明示的に閉じる
+            wb.close()
 
     @staticmethod
     def _extract_pdf(p: Path) -> str:
@@ -1,8 +1,13 @@
 from dataclasses import dataclass
 from typing import Optional, Iterator, List, Dict, Any, Tuple, Union
 from pathlib import Path
-from datetime import datetime
+import hashlib
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from services.project_service import ProjectService
 from services.ai_log import AiRunLogger
 
@@ -11,6 +16,10 @@ from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
+
+from extensions import db
 from services.doc_service import DocService
 from models.knowledge import Knowledge
 from tools import fs_tools
@@ -23,8 +32,157 @@ from tools import office_pptx_tool
 from tools import pdf_tool
 from tools import agents_tools
 
+# デバッグ出力用（ローカル変数 logger は AiRunLogger を指すため別名にしている）
+_log = logging.getLogger(__name__)
+
+# LLM に公開するツール（bind_tools の順序どおり）。名前 -> ツール の対応表もここから作る
+_TOOLS = (
+    # FS/Text ツール
+    fs_tools.find_files,
+    fs_tools.write_file,
+    fs_tools.read_file,
+    fs_tools.list_files,
+    fs_tools.list_dirs,
+    fs_tools.make_dirs,
+    fs_tools.file_stat,
+    fs_tools.read_file_range,
+    fs_tools.search_grep,
+    # RAG
+    rag_tools.rag_index_text,
+    rag_tools.rag_update_index,
+    rag_tools.rag_build_index,
+    rag_tools.rag_query_text,
+    # ネットワーク
+    network_tool.fetch_url_text,
+    network_tool.fetch_url_links,
+    # Git
+    git_tool.git_diff_files,
+    git_tool.git_diff_patch,
+    git_tool.git_list_branches,
+    git_tool.git_current_branch,
+    git_tool.git_log_range,
+    git_tool.git_show_file,
+    git_tool.git_status_porcelain,
+    git_tool.git_rev_parse,
+    git_tool.git_repo_root,
+    git_tool.git_diff_own_changes_files,
+    # office 読み取り系
+    office_word_tool.read_docx_text,
+    office_excel_tool.read_xlsx_text,
+    office_pptx_tool.read_pptx_text,
+    # PDF
+    pdf_tool.read_pdf_text,
+    # CSV 書き出し（CP932／Excel互換）
+    agents_tools.csv_write_cp932,
+    # CSV→XLSX 変換（出力は doc_path 基準）
+    agents_tools.csv_to_xlsx,
+    # Markdown→Word 変換（出力は doc_path 基準）
+    agents_tools.md_to_docx,
+)
+# LangChain Tool は .name、生の関数は関数名がツール名になる
+_TOOL_MAP = {getattr(t, "name", None) or t.__name__: t for t in _TOOLS}
+# ツール名 -> 引数 dict を受け取る呼び出し口（LangChain Tool か生の関数かの判定は起動時に1回だけ行う）
+_TOOL_DISPATCH = {
+    name: (t.invoke if hasattr(t, "invoke") else (lambda args, _t=t: _t(**args)))
+    for name, t in _TOOL_MAP.items()
+}
+# 検索系ツール（base_path を doc_path 配下に固定する対象）
+_BASE_PATH_TOOLS = frozenset({"find_files", "list_files", "list_dirs", "search_grep"})
+
+# 内容が固定のシステムメッセージ（リクエストごとに作り直さず共有する）
+# プロジェクトによって変わる内容は入れないこと（プロバイダ側のプロンプトキャッシュは先頭一致で効く）
+_STATIC_SYSTEM_MESSAGES = (
+    SystemMessage(content=(
+        "# 役割\n"
+        "* あなたは有能なソフトウェア設計・開発のアシスタントです。\n"
+        "* 最終出力は必ず日本語で、Markdown整形（見出し・箇条書き・表など）で分かりやすく書いてください。\n"
+        "* あなたはローカル環境で動作しており、バインド済みのツールを使ってファイルシステムにアクセスできます。\n"
+        "* C: などの絶対パスも、ツール（find_files / read_file など）を通じて直接扱えます。\n"
+        "* 『この環境からはアクセスできません』などと回答せず、必ず該当ツールを呼び出してください。\n"
+        "* 与えられたプロンプトにソースコード、または関数名、または、変数名が含まれる場合、ツールでソースを調べるようにしてください。\n"
+        "* ソースコードが見つからない場合は、その旨を回答に含めてください。ユーザーがソースを見て回答したのか、憶測で回答したのかをわかるようにしたいです。\n"
+        "* ファイルを読む前にfile_statでファイルサイズを取得し、大きなファイルの場合はread_file_rangeを使ってください\n"
+    )),
+    SystemMessage(content=(
+        "# gitに関するガイド:\n"
+        "- 差分を求められた場合、特段指示がなければgit_diff_own_changes_filesで差分を取得してください。\n"
+    )),
+    SystemMessage(content=(
+        "# ソースコード修正時のガイド:\n"
+        "- 1000行以下のファイルの場合、新しくソースプログラムをwrite_fileで書き換える。\n"
+        "- 1000行より大きいファイルの場合、ソースは変更せず、修正が必要な分をメッセージで表示する。\n"
+        "- 許可された場合は、1000行以上のソースコードも修正する\n"
+        "- 可能であればどのあたりにソースコードを適用すればよいか、行番号で教えること。\n"
+        "- 修正時は修正に必要な個所のみ修正すること。不必要な修正は行わないこと。\n"
+    )),
+)
+
+# 長いツールループの途中で再掲するルール（固定のシステムメッセージと同じ本文を1つにまとめたもの）
+_RULES_REMINDER = SystemMessage(content=(
+    "# ルール再掲（引き続き以下のルールに従ってください）\n\n"
+    + "\n".join(m.content for m in _STATIC_SYSTEM_MESSAGES)
+))
+
+# デバッグログ用: 改行等をエスケープして1行にする
+_LOG_ESCAPE = str.maketrans({"\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+
+def _log_preview(text: str, limit: int) -> str:
+    """ログ用に先頭 limit 文字だけをエスケープして返す（長い本文全体は変換しない）。"""
+    s = text[:limit].translate(_LOG_ESCAPE)
+    if len(text) > limit or len(s) > limit:
+        return s[:limit] + "...(truncated)"
+    return s
+
+
+def _estimate_tokens(msg: Any) -> int:
+    """メッセージのおおよそのトークン数。UTF-8 のバイト数/3 で見積もる（英字は多め、和文はほぼ1文字1トークン）。"""
+    content = getattr(msg, "content", "")
+    if not isinstance(content, str):
+        content = str(content)
+    n = len(content.encode("utf-8")) // 3 + 4
+    tool_calls = getattr(msg, "tool_calls", None)
+    if tool_calls:
+        n += len(str(tool_calls).encode("utf-8")) // 3
+    return n
+
+
+def _is_context_overflow(e: BaseException) -> bool:
+    """コンテキスト長超過のエラーか（OpenAI は code=context_length_exceeded を返す）。"""
+    return getattr(e, "code", None) == "context_length_exceeded" or "context_length_exceeded" in str(e)
+
 
 class GptProvider(object):
+    # _fetch_knowledge の結果キャッシュ（(project_id, categories, limit) -> (指紋, 本文)）。古いものから破棄する
+    KNOWLEDGE_CACHE_MAX = 64
+    _knowledge_cache: "OrderedDict[tuple, Tuple[tuple, str]]" = OrderedDict()
+    _knowledge_lock = threading.Lock()
+    # doc_path / 検索サブディレクトリの resolve() 結果キャッシュ（キー -> (時刻, Path)）。成功した解決のみ保持する
+    PATH_CACHE_TTL = 30.0
+    PATH_CACHE_MAX = 512
+    _path_cache: "OrderedDict[tuple, Tuple[float, Path]]" = OrderedDict()
+    _path_lock = threading.Lock()
+    # 入力の見積もりトークン数の上限（超える分は古い履歴から落とす）と、超過エラー時に1回で落とすメッセージ数
+    MAX_CONTEXT_TOKENS = 200_000
+    CONTEXT_TRIM_MESSAGES = 32
+    # このターン数ごとにルールを再掲する
+    RULES_REMINDER_INTERVAL = 10
+    # ツール結果の直後のターンの応答キャッシュ（会話のハッシュ -> (時刻, AIMessage)）。同じ会話なら LLM を呼ばずに使い回す
+    LLM_CACHE_TTL = 300.0
+    LLM_CACHE_MAX = 256
+    _llm_cache: "OrderedDict[bytes, Tuple[float, Any]]" = OrderedDict()
+    _llm_lock = threading.Lock()
+    # 1ターンに複数呼ばれたとき並行に実行してよい（読み取り専用の）ツール
+    PARALLEL_SAFE_TOOLS = frozenset({
+        "list_files", "list_dirs", "read_file", "find_files", "file_stat", "read_file_range", "search_grep",
+        "fetch_url_text", "fetch_url_links",
+        "git_diff_files", "git_diff_patch", "git_list_branches", "git_current_branch", "git_log_range",
+        "git_show_file", "git_status_porcelain", "git_rev_parse", "git_repo_root", "git_diff_own_changes_files",
+        "read_docx_text", "read_xlsx_text", "read_pptx_text", "read_pdf_text",
+    })
+    # ツール並行実行用のスレッドプール（プロセス内で共有）
+    _tool_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tool")
+
     def __init__(
         self,
         model: str = "gpt-5",
@@ -44,105 +202,42 @@ class GptProvider(object):
         self.ai_log_enabled = ai_log_enabled
 
         # ツールのバインド（LLM 側に公開する関数群）
-        self.llm_with_tool = self.llm.bind_tools([
-            # FS/Text ツール
-            fs_tools.find_files,
-            fs_tools.write_file,
-            fs_tools.read_file,
-            fs_tools.list_files,
-            fs_tools.list_dirs,
-            fs_tools.make_dirs,
-            fs_tools.file_stat,
-            fs_tools.read_file_range,
-            fs_tools.search_grep,
-            # RAG
-            rag_tools.rag_index_text,
-            rag_tools.rag_update_index,
-            rag_tools.rag_build_index,
-            rag_tools.rag_query_text,
-            # ネットワーク
-            network_tool.fetch_url_text,
-            network_tool.fetch_url_links,
-            # Git
-            git_tool.git_diff_files,
-            git_tool.git_diff_patch,
-            git_tool.git_list_branches,
-            git_tool.git_current_branch,
-            git_tool.git_log_range,
-            git_tool.git_show_file,
-            git_tool.git_status_porcelain,
-            git_tool.git_rev_parse,
-            git_tool.git_repo_root,
-            git_tool.git_diff_own_changes_files,
-            # office 読み取り系
-            office_word_tool.read_docx_text,
-            office_excel_tool.read_xlsx_text,
-            office_pptx_tool.read_pptx_text,
-            # PDF
-            pdf_tool.read_pdf_text,
-            # CSV 書き出し（CP932／Excel互換）
-            agents_tools.csv_write_cp932,
-            # CSV→XLSX 変換（出力は doc_path 基準）
-            agents_tools.csv_to_xlsx,
-            # Markdown→Word 変換（出力は doc_path 基準）
-            agents_tools.md_to_docx,
-        ])
-        # 検索系ツール（base_path を doc_path 配下に固定する対象）
-        self._tools_require_base_path = {"find_files", "list_files", "list_dirs", "search_grep"}
-        self.tool_map = {
-            # FS/Text ツール
-            "list_files": fs_tools.list_files,
-            "list_dirs": fs_tools.list_dirs,
-            "read_file": fs_tools.read_file,
-            "write_file": fs_tools.write_file,
-            "find_files": fs_tools.find_files,
-            "make_dirs": fs_tools.make_dirs,
-            "file_stat": fs_tools.file_stat,
-            "read_file_range": fs_tools.read_file_range,
-            "search_grep": fs_tools.search_grep,
-
-            # RAG
-            "rag_build_index": rag_tools.rag_build_index,
-            "rag_update_index": rag_tools.rag_update_index,
-            "rag_index_text": rag_tools.rag_index_text,
-            "rag_query_text": rag_tools.rag_query_text,
-            # ネットワーク
-            "fetch_url_text": network_tool.fetch_url_text,
-            "fetch_url_links": network_tool.fetch_url_links,
-            # Git
-            "git_diff_files": git_tool.git_diff_files,
-            "git_diff_patch": git_tool.git_diff_patch,
-            "git_list_branches": git_tool.git_list_branches,
-            "git_current_branch": git_tool.git_current_branch,
-            "git_log_range": git_tool.git_log_range,
-            "git_show_file": git_tool.git_show_file,
-            "git_status_porcelain": git_tool.git_status_porcelain,
-            "git_rev_parse": git_tool.git_rev_parse,
-            "git_repo_root": git_tool.git_repo_root,
-            "git_diff_own_changes_files": git_tool.git_diff_own_changes_files,
-            # office 読み取り系
-            "read_docx_text": office_word_tool.read_docx_text,
-            "read_xlsx_text": office_excel_tool.read_xlsx_text,
-            "read_pptx_text": office_pptx_tool.read_pptx_text,
-            # PDF
-            "read_pdf_text": pdf_tool.read_pdf_text,
-            # CSV 書き出し
-            "csv_write_cp932": agents_tools.csv_write_cp932,
-            # CSV→XLSX 変換
-            "csv_to_xlsx": agents_tools.csv_to_xlsx,
-            # Markdown→Word 変換
-            "md_to_docx": agents_tools.md_to_docx,
-        }
+        self.llm_with_tool = self.llm.bind_tools(list(_TOOLS))
+        self._tools_require_base_path = _BASE_PATH_TOOLS
+        self.tool_map = _TOOL_MAP
+        self._tool_dispatch = _TOOL_DISPATCH
+
+    def _cached_path(self, key: tuple) -> Optional[Path]:
+        now = time.monotonic()
+        with self._path_lock:
+            hit = self._path_cache.get(key)
+            if hit is not None and now - hit[0] < self.PATH_CACHE_TTL:
+                self._path_cache.move_to_end(key)
+                return hit[1]
+        return None
+
+    def _store_path(self, key: tuple, path: Path) -> None:
+        with self._path_lock:
+            self._path_cache[key] = (time.monotonic(), path)
+            self._path_cache.move_to_end(key)
+            while len(self._path_cache) > self.PATH_CACHE_MAX:
+                self._path_cache.popitem(last=False)
 
     def _project_base_dir(self, project_id: int) -> Path:
         """project_id から doc_path を解決し、存在するディレクトリ Path を返す。"""
-        ps = ProjectService()
-        proj = ps.fetch_by_id(project_id)
-        if not proj or not getattr(proj, "doc_path", None):
+        # doc_path は ProjectService のメタ情報キャッシュ（更新時に破棄される）から取る
+        meta = ProjectService().fetch_meta(project_id)
+        doc_path = getattr(meta, "doc_path", None) if meta else None
+        if not doc_path:
             raise ValueError("doc_path_not_set")
-        base = Path(proj.doc_path).expanduser().resolve()
+        key = ("base", doc_path)
+        base = self._cached_path(key)
+        if base is not None:
+            return base
+        base = Path(doc_path).expanduser().resolve()
         if (not base.exists()) or (not base.is_dir()):
             raise ValueError("invalid_doc_path")
+        self._store_path(key, base)
         return base
 
     def _resolve_search_base(self, base_dir: Path, requested: Optional[str]) -> Path:
@@ -173,6 +268,10 @@ class GptProvider(object):
         parts = [p for p in s.split("/") if p not in ("", ".")]
         if any(p == ".." for p in parts):
             return base_dir
+        key = ("sub", str(base_dir), "/".join(parts))
+        cached = self._cached_path(key)
+        if cached is not None:
+            return cached
         sub = (base_dir / "/".join(parts)).resolve()
         try:
             # base_dir 配下であることを確認
@@ -180,6 +279,7 @@ class GptProvider(object):
         except Exception:
             return base_dir
         if sub.exists() and sub.is_dir():
+            self._store_path(key, sub)
             return sub
         return base_dir
 
@@ -195,87 +295,135 @@ class GptProvider(object):
         knowledge_limit: int = 8,
         knowledge_categories: Optional[List[str]] = None,
     ):
-        messages: List[Any] = [
-            SystemMessage(content=(
-                "# 役割\n"
-                "* あなたは有能なソフトウェア設計・開発のアシスタントです。\n"
-                f"* ツールを使用する際に使用するproject_idは{project_id}を使ってください。\n"
-                "* 最終出力は必ず日本語で、Markdown整形（見出し・箇条書き・表など）で分かりやすく書いてください。\n"
-                "* あなたはローカル環境で動作しており、バインド済みのツールを使ってファイルシステムにアクセスできます。\n"
-                "* C: などの絶対パスも、ツール（find_files / read_file など）を通じて直接扱えます。\n"
-                "* 『この環境からはアクセスできません』などと回答せず、必ず該当ツールを呼び出してください。\n"
-                "* 与えられたプロンプトにソースコード、または関数名、または、変数名が含まれる場合、ツールでソースを調べるようにしてください。\n"
-                "* ソースコードが見つからない場合は、その旨を回答に含めてください。ユーザーがソースを見て回答したのか、憶測で回答したのかをわかるようにしたいです。\n"
-                "* ファイルを読む前にfile_statでファイルサイズを取得し、大きなファイルの場合はread_file_rangeを使ってください\n"
-            )),
-            SystemMessage(content=(
-                "# gitに関するガイド:\n"
-                "- 差分を求められた場合、特段指示がなければgit_diff_own_changes_filesで差分を取得してください。\n"
-            )),
-
-            SystemMessage(content=(
-                "# ソースコード修正時のガイド:\n"
-                "- 1000行以下のファイルの場合、新しくソースプログラムをwrite_fileで書き換える。\n"
-                "- 1000行より大きいファイルの場合、ソースは変更せず、修正が必要な分をメッセージで表示する。\n"
-                "- 許可された場合は、1000行以上のソースコードも修正する\n"
-                "- 可能であればどのあたりにソースコードを適用すればよいか、行番号で教えること。\n"
-                "- 修正時は修正に必要な個所のみ修正すること。不必要な修正は行わないこと。\n"
-            )),
-        ]
+        # プロンプトキャッシュが効くよう、先頭は全プロジェクト共通の固定部分にする
+        # 並び: [固定のシステム] → [履歴] → [project_id・ナレッジ] → [今回のプロンプト]
+        messages: List[Any] = list(_STATIC_SYSTEM_MESSAGES)
 
+        # 過去のやり取りを戻す
+        for prompt, content in svc.fetch_history_pairs(project_id=project_id, limit=history_limit):
+            if prompt:
+                messages.append(HumanMessage(content=prompt))
+            if content:
+                messages.append(AIMessage(content=content))
+
+        kn = ""
         if use_knowledge and Knowledge is not None:
             kn = self._fetch_knowledge(project_id=project_id, limit=knowledge_limit, categories=knowledge_categories)
-            if kn:
-                messages.append(SystemMessage(content=(
-                    "以下はプロジェクトのナレッジベース（Markdown）です。"
-                    "この内容を最優先で尊重して回答してください。\n\n" + kn
-                )))
-
-        # 過去のやり取りを戻す
-        history = svc.fetch_history(project_id=project_id, limit=history_limit, newest_first=False)
-        for memo in history:
-            if getattr(memo, "prompt", None):
-                messages.append(HumanMessage(content=memo.prompt))
-            if getattr(memo, "content", None):
-                messages.append(AIMessage(content=memo.content))
+        messages.append(self._dynamic_context_message(project_id, kn))
         messages.append(HumanMessage(content=new_prompt))
+
+        # 見積もりが上限を超える場合は古い履歴から落とす（固定部分・今回のプロンプトは残す）
+        head = len(_STATIC_SYSTEM_MESSAGES)
+        sizes = [_estimate_tokens(m) for m in messages]
+        excess = sum(sizes) - self.MAX_CONTEXT_TOKENS
+        drop = 0
+        while excess > 0 and head + drop < len(messages) - 2:
+            excess -= sizes[head + drop]
+            drop += 1
+        # やり取りの途中（assistant の応答だけ）が先頭に残らないようにする
+        while drop and head + drop < len(messages) - 2 and isinstance(messages[head + drop], AIMessage):
+            drop += 1
+        if drop:
+            del messages[head:head + drop]
         return messages
 
+    @staticmethod
+    def _trim_conversation(conversation: List[Any], ctx_index: int, count: int) -> Tuple[int, int]:
+        """古いメッセージを count 件まで落とす。落とした件数と、動的コンテキストの新しい位置を返す。
+        まず履歴（固定部分と動的コンテキストの間）から落とし、無ければ今回のプロンプト以降のツールのやり取りから落とす。
+        """
+        head = len(_STATIC_SYSTEM_MESSAGES)
+        n = min(count, ctx_index - head)
+        if n > 0:
+            del conversation[head:head + n]
+            return n, ctx_index - n
+        start = ctx_index + 2  # 動的コンテキスト・今回のプロンプトの次
+        end = min(start + count, len(conversation))
+        # 対応する assistant を失った ToolMessage が先頭に残らないようにする
+        while end < len(conversation) and isinstance(conversation[end], ToolMessage):
+            end += 1
+        n = end - start
+        if n > 0:
+            del conversation[start:end]
+        return max(n, 0), ctx_index
+
     def _debug_print_messages(self, messages: List[Any], head: str = "") -> None:
-        """メッセージ配列をデバッグ出力する（内容は長すぎる場合は一部省略）。"""
+        """メッセージ配列をデバッグ出力する（内容は長すぎる場合は一部省略）。
+        DEBUG レベルが無効なら何もしない（整形コストも発生させない）。
+        """
+        if not _log.isEnabledFor(logging.DEBUG):
+            return
         try:
             if head:
-                print(head)
+                _log.debug(head)
             for i, m in enumerate(messages, 1):
                 role = getattr(m, "type", None) or m.__class__.__name__
                 content = getattr(m, "content", "")
-                if isinstance(content, str):
-                    s = content.replace("\n", "\\n")
-                    if len(s) > 300:
-                        s = s[:300] + "...(truncated)"
-                else:
-                    s = str(content)
-                print(f"[{i:02d}] {role}: {s}")
-            print("-" * 60)
+                s = _log_preview(content, 300) if isinstance(content, str) else str(content)
+                _log.debug("[%02d] %s: %s", i, role, s)
+            _log.debug("-" * 60)
         except Exception as e:
-            print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] _debug_print_messages error: {e}")
+            _log.debug("_debug_print_messages error: %s", e)
+
+    @staticmethod
+    def _dynamic_context_message(project_id: int, knowledge_md: str) -> SystemMessage:
+        """プロジェクトごとに変わる指示（project_id とナレッジ）をまとめたシステムメッセージ。"""
+        content = (
+            "# プロジェクト\n"
+            f"* ツールを使用する際に使用するproject_idは{project_id}を使ってください。\n"
+        )
+        if knowledge_md:
+            content += (
+                "\n以下はプロジェクトのナレッジベース（Markdown）です。"
+                "この内容を最優先で尊重して回答してください。\n\n" + knowledge_md
+            )
+        return SystemMessage(content=content)
 
     def _fetch_knowledge(self, *, project_id: int, limit: int, categories: Optional[List[str]] = None) -> str:
+        """
+        プロンプトに載せるナレッジ本文を返す。
+        件数と最終更新日時（1回の集計クエリ）が前回と同じなら、組み立て済みの本文を使い回す。
+        """
+        # カテゴリは IN 条件なので順序・重複は結果に影響しない。正規化してキャッシュのヒット率を上げる
+        key = (project_id, tuple(sorted(set(categories or ()))), limit)
+        try:
+            fingerprint = tuple(db.session.execute(
+                select(func.count(), func.max(Knowledge.updated_at)).where(Knowledge.project_id == project_id)
+            ).one())
+        except Exception:
+            fingerprint = None
+        if fingerprint is not None:
+            with self._knowledge_lock:
+                hit = self._knowledge_cache.get(key)
+                if hit is not None and hit[0] == fingerprint:
+                    self._knowledge_cache.move_to_end(key)
+                    return hit[1]
+
+        text = self._query_knowledge(project_id=project_id, limit=limit, categories=categories)
+        if fingerprint is not None:
+            with self._knowledge_lock:
+                self._knowledge_cache[key] = (fingerprint, text)
+                self._knowledge_cache.move_to_end(key)
+                while len(self._knowledge_cache) > self.KNOWLEDGE_CACHE_MAX:
+                    self._knowledge_cache.popitem(last=False)
+        return text
+
+    def _query_knowledge(self, *, project_id: int, limit: int, categories: Optional[List[str]] = None) -> str:
         try:
-            q = Knowledge.query.filter_by(project_id=project_id)
+            # 使うのは title/content だけなので、ORM インスタンスを作らず列だけを取る
+            stmt = select(Knowledge.title, Knowledge.content).where(Knowledge.project_id == project_id)
             if categories:
-                q = q.filter(Knowledge.category.in_(categories))
-            q = q.order_by(Knowledge.order.asc(), Knowledge.updated_at.desc(), Knowledge.knowledge_id.asc())
-            rows = q.limit(limit).all()
+                stmt = stmt.where(Knowledge.category.in_(categories))
+            stmt = stmt.order_by(Knowledge.order.asc(), Knowledge.updated_at.desc(), Knowledge.knowledge_id.asc())
+            rows = db.session.execute(stmt.limit(limit)).all()
         except Exception:
             rows = []
         if not rows:
             return ""
         parts: List[str] = []
-        for r in rows:
-            title = r.title or ""
+        for title, content in rows:
             head = f"## {title}" if title else ""
-            body = (r.content or "").strip()
+            body = (content or "").strip()
             parts.append(f"{head}\n{body}" if head else body)
         return "\n\n".join(parts)
 
@@ -374,7 +522,7 @@ class GptProvider(object):
             })
         except Exception as _e:
             # ロガー初期化に失敗しても処理は継続
-            print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] logger init failed: {_e}")
+            _log.debug("logger init failed: %s", _e)
 
         # 1) ベースメッセージ作成
         messages = self._build_messages(
@@ -390,10 +538,12 @@ class GptProvider(object):
             logger.messages_initial(messages)
         except Exception:
             pass
-        self._debug_print_messages(messages, head=f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] Initial conversation (with system/history/prompt)")
+        self._debug_print_messages(messages, head="Initial conversation (with system/history/prompt)")
 
         # 2) ツールを使用した応答生成
-        conversation = messages[:]
+        # messages は以降使わないので、コピーせずそのまま会話として伸ばしていく
+        conversation = messages
+        ctx_index = len(conversation) - 2  # 動的コンテキスト（project_id・ナレッジ）の位置
         tool_call_count = 0  # ツール呼び出し回数をカウント
         turn = 1  # デバッグ用: ループターン番号
 
@@ -414,9 +564,22 @@ class GptProvider(object):
                 logger.turn_start(turn, conversation_len=len(conversation))
             except Exception:
                 pass
-            print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] === TURN {turn} START ===")
+            _log.debug("=== TURN %s START ===", turn)
 
-            ai_msg = self.llm_with_tool.invoke(conversation)
+            while True:
+                try:
+                    ai_msg = self._invoke_llm(conversation)
+                    break
+                except Exception as e:
+                    if not _is_context_overflow(e):
+                        raise
+                    dropped, ctx_index = self._trim_conversation(conversation, ctx_index, self.CONTEXT_TRIM_MESSAGES)
+                    if not dropped:
+                        raise
+                    try:
+                        logger.info("context length exceeded; trimmed old messages", extra={"dropped": dropped})
+                    except Exception:
+                        pass
             tool_calls = getattr(ai_msg, "tool_calls", None)
             try:
                 logger.ai_raw(turn, getattr(ai_msg, "content", ""), tool_calls_preview=tool_calls)
@@ -427,13 +590,11 @@ class GptProvider(object):
                 # ツール呼び出しがない場合はそのままストリームを返す
                 text = (getattr(ai_msg, "content", "") or "")
                 # DEBUG: 最終応答テキスト
-                try:
-                    prev = (text or "").replace("\n", "\\n")
-                    if len(prev) > 500:
-                        prev = prev[:500] + "...(truncated)"
-                    print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] Final AI content: {prev}")
-                except Exception as e:
-                    print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] print final content failed: {e}")
+                if _log.isEnabledFor(logging.DEBUG):
+                    try:
+                        _log.debug("Final AI content: %s", _log_preview(text or "", 500))
+                    except Exception as e:
+                        _log.debug("print final content failed: %s", e)
                 try:
                     logger.final_text(text)
                     logger.end_session(status="ok", summary=f"turns={turn-1}, tools={tool_call_count}")
@@ -441,23 +602,25 @@ class GptProvider(object):
                 except Exception:
                     pass
                 yield text
-                print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] === TURN {turn} END (no tools) ===")
-                print("\n[FIN]")
+                _log.debug("=== TURN %s END (no tools) === [FIN]", turn)
                 return
 
             conversation.append(ai_msg)  # assistant（tool_callsあり）
 
             # DEBUG: このターンのAI生出力（tool_calls あり）
-            try:
-                preview = getattr(ai_msg, "content", "") or ""
-                if isinstance(preview, str) and len(preview) > 200:
-                    preview = preview[:200] + "...(truncated)"
-                print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] AI(tool_calls) content: {preview}")
-                print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] tool_calls: {tool_calls}")
-            except Exception as e:
-                print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] print ai_msg failed: {e}")
+            if _log.isEnabledFor(logging.DEBUG):
+                try:
+                    preview = getattr(ai_msg, "content", "") or ""
+                    if isinstance(preview, str):
+                        preview = _log_preview(preview, 200)
+                    _log.debug("AI(tool_calls) content: %s", preview)
+                    _log.debug("tool_calls: %s", tool_calls)
+                except Exception as e:
+                    _log.debug("print ai_msg failed: %s", e)
 
             latest_tool_messages: List[ToolMessage] = []
+            prepared: List[Tuple[Optional[str], Dict[str, Any], Optional[str]]] = []
+            errors: Dict[int, str] = {}
             for call in tool_calls:
                 name = call.get("name")
                 args = call.get("args", {}) or {}
@@ -467,46 +630,21 @@ class GptProvider(object):
                     logger.tool_call(turn, name, args, call_id)
                 except Exception:
                     pass
-
-                print(f"{name} {args}")
-                print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] Call tool: {name} args={args}")
+                _log.debug("Call tool: %s args=%s", name, args)
                 try:
-                    # 検索系ツールなら base_path を doc_path に強制上書き（ただし doc_path 配下の絶対パス指定は尊重）
-                    if name in self._tools_require_base_path:
-                        args = dict(args)
-                        requested = args.get("base_path") or args.get("path") or args.get("start_dir")
-                        search_base: Path
-                        if requested:
-                            try:
-                                req_path = Path(str(requested)).expanduser().resolve()
-                            except Exception:
-                                req_path = None  # type: ignore
-                            if req_path and req_path.is_absolute():
-                                try:
-                                    # doc_path 配下であれば尊重（そのまま使用）
-                                    req_path.relative_to(base_dir)
-                                    search_base = req_path if (req_path.exists() and req_path.is_dir()) else base_dir
-                                except Exception:
-                                    # doc_path 外の絶対パスは拒否して doc_path にフォールバック
-                                    search_base = base_dir
-                            else:
-                                # 相対指定は従来ロジックで解決
-                                search_base = self._resolve_search_base(base_dir, str(requested))
-                        else:
-                            search_base = base_dir
-                        args["base_path"] = str(search_base)
-                    if name in self.tool_map:
-                        _tool = self.tool_map[name]
-                        if hasattr(_tool, "invoke"):
-                            result = _tool.invoke(args)  # LangChain Tool
-                        else:
-                            result = _tool(**args)  # 生の関数
-                    else:
-                        result = f"error=Unknown tool: {name}"
+                    args = self._prepare_tool_args(name, args, base_dir)
                 except Exception as e:
-                    result = f"error={type(e).__name__}: {e}"
-                    print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}]", e)
+                    errors[len(prepared)] = f"error={type(e).__name__}: {e}"
+                    _log.debug("tool %s failed: %s", name, e)
+                prepared.append((name, args, call_id))
+
+            # 引数の準備に失敗したものは実行せず、エラー文字列を結果にする
+            runnable = [k for k in range(len(prepared)) if k not in errors]
+            results = [errors.get(k) for k in range(len(prepared))]
+            for k, result in zip(runnable, self._run_tools([prepared[k][:2] for k in runnable])):
+                results[k] = result
 
+            for (name, args, call_id), result in zip(prepared, results):
                 # ここでツール結果を縮約してから会話へ載せる
                 safe = self._summarize_tool_result(name, args, result, max_chars=16000)
                 latest_tool_messages.append(ToolMessage(content=safe, tool_call_id=call_id))
@@ -515,24 +653,25 @@ class GptProvider(object):
                 except Exception:
                     pass
                 tool_call_count += 1
-                print(f"Tool called {tool_call_count} times")
+                _log.debug("Tool called %s times", tool_call_count)
 
             conversation.extend(latest_tool_messages)
 
-            # DEBUG: ツール実行結果（ToolMessage）もコンソール出力
-            try:
-                for tm in latest_tool_messages:
-                    c = getattr(tm, "content", "")
-                    s = (c[:300] + "...(truncated)") if isinstance(c, str) and len(c) > 300 else c
-                    print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] ToolMessage -> {s}")
-            except Exception as e:
-                print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] print tool messages failed: {e}")
+            # DEBUG: ツール実行結果（ToolMessage）もログ出力
+            if _log.isEnabledFor(logging.DEBUG):
+                try:
+                    for tm in latest_tool_messages:
+                        c = getattr(tm, "content", "")
+                        _log.debug("ToolMessage -> %s", _log_preview(c, 300) if isinstance(c, str) else c)
+                except Exception as e:
+                    _log.debug("print tool messages failed: %s", e)
+
+            # 長いループでルールが薄れないよう、一定ターンごとに再掲する（既存の会話は作り直さない）
+            if turn % self.RULES_REMINDER_INTERVAL == 0:
+                conversation.append(_RULES_REMINDER)
 
             # ターン終了（ツール実行ありのケース）
-            try:
-                print(f"[{datetime.now().strftime('%Y/%m/%d %H:%M:%S')}] [DEBUG] === TURN {turn} END ===")
-            except Exception:
-                pass
+            _log.debug("=== TURN %s END ===", turn)
             turn += 1
 
         # 最大回数に達した場合のみメッセージを出力
@@ -543,6 +682,120 @@ class GptProvider(object):
             pass
         if tool_call_count >= max_tool_turns:
             yield "（注意）最大ツール実行回数に達しました。"
+    def _llm_cache_key(self, conversation: List[Any]) -> Optional[bytes]:
+        """ツール結果（またはルール再掲）で終わる会話だけを対象に、モデル設定と会話内容のハッシュを返す。
+        tool_call_id は呼び出しごとに変わるため含めない（ツール名・引数・結果本文で比較する）。
+        """
+        if not conversation or not isinstance(conversation[-1], (ToolMessage, SystemMessage)):
+            return None
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{getattr(self.llm, 'model_name', '')}\x1f{getattr(self.llm, 'temperature', '')}".encode())
+        for m in conversation:
+            content = m.content if isinstance(m.content, str) else str(m.content)
+            h.update(b"\x1e" + m.type.encode() + b"\x1f" + content.encode("utf-8"))
+            tool_calls = getattr(m, "tool_calls", None)
+            if tool_calls:
+                h.update(b"\x1f" + repr([(tc.get("name"), tc.get("args")) for tc in tool_calls]).encode("utf-8"))
+        return h.digest()
+
+    def _invoke_llm(self, conversation: List[Any]) -> Any:
+        """llm_with_tool.invoke の前に、直前に同じ会話で得た応答があればそれを返す。"""
+        key = self._llm_cache_key(conversation)
+        if key is not None:
+            now = time.monotonic()
+            with self._llm_lock:
+                hit = self._llm_cache.get(key)
+                if hit is not None and now - hit[0] < self.LLM_CACHE_TTL:
+                    self._llm_cache.move_to_end(key)
+                    _log.debug("LLM cache hit")
+                    return hit[1]
+        ai_msg = self.llm_with_tool.invoke(conversation)
+        if key is not None:
+            with self._llm_lock:
+                self._llm_cache[key] = (time.monotonic(), ai_msg)
+                self._llm_cache.move_to_end(key)
+                while len(self._llm_cache) > self.LLM_CACHE_MAX:
+                    self._llm_cache.popitem(last=False)
+        return ai_msg
+
+    def _prepare_tool_args(self, name: Optional[str], args: Dict[str, Any], base_dir: Path) -> Dict[str, Any]:
+        """検索系ツールなら base_path を doc_path に強制上書きする（ただし doc_path 配下の絶対パス指定は尊重）。"""
+        if name not in self._tools_require_base_path:
+            return args
+        args = dict(args)
+        requested = args.get("base_path") or args.get("path") or args.get("start_dir")
+        base_str = str(base_dir)
+        # 未指定、または doc_path そのもの（よくあるケース）は Path を作らずに決める
+        if not requested or requested == base_str:
+            args["base_path"] = base_str
+            return args
+        key = ("req", base_str, str(requested))
+        cached = self._cached_path(key)
+        if cached is not None:
+            args["base_path"] = str(cached)
+            return args
+        try:
+            req_path = Path(str(requested)).expanduser().resolve()
+        except Exception:
+            req_path = None  # type: ignore
+        search_base: Path
+        if req_path and req_path.is_absolute():
+            try:
+                # doc_path 配下であれば尊重（そのまま使用）
+                req_path.relative_to(base_dir)
+                search_base = req_path if (req_path.exists() and req_path.is_dir()) else base_dir
+                if search_base is req_path:
+                    self._store_path(key, req_path)
+            except Exception:
+                # doc_path 外の絶対パスは拒否して doc_path にフォールバック
+                search_base = base_dir
+        else:
+            # 相対指定は従来ロジックで解決
+            search_base = self._resolve_search_base(base_dir, str(requested))
+        args["base_path"] = str(search_base)
+        return args
+
+    def _invoke_tool(self, name: Optional[str], args: Dict[str, Any]) -> Any:
+        """ツールを1つ実行して結果を返す。例外は結果文字列に変換する。"""
+        fn = self._tool_dispatch.get(name)
+        if fn is None:
+            return f"error=Unknown tool: {name}"
+        try:
+            return fn(args)
+        except Exception as e:
+            _log.debug("tool %s failed: %s", name, e)
+            return f"error={type(e).__name__}: {e}"
+
+    def _invoke_tool_in_app(self, app, name: Optional[str], args: Dict[str, Any]) -> Any:
+        # ツールは DB（doc_path の解決）を使うので、ワーカースレッドでもアプリコンテキストを張る
+        if app is None:
+            return self._invoke_tool(name, args)
+        with app.app_context():
+            return self._invoke_tool(name, args)
+
+    def _run_tools(self, calls: List[Tuple[Optional[str], Dict[str, Any]]]) -> List[Any]:
+        """
+        1ターン分のツール呼び出しを実行し、入力順に結果を返す。
+        読み取り専用のツールが連続する区間はスレッドプールで並行に実行し、
+        書き込みを伴うツールは順序を保つため単独で（前後の区間を待ってから）実行する。
+        """
+        results: List[Any] = [None] * len(calls)
+        app = current_app._get_current_object() if has_app_context() else None
+        i = 0
+        while i < len(calls):
+            j = i
+            while j < len(calls) and calls[j][0] in self.PARALLEL_SAFE_TOOLS:
+                j += 1
+            if j - i > 1:
+                futures = [self._tool_pool.submit(self._invoke_tool_in_app, app, *calls[k]) for k in range(i, j)]
+                for k, fut in zip(range(i, j), futures):
+                    results[k] = fut.result()
+                i = j
+            else:
+                results[i] = self._invoke_tool(*calls[i])
+                i += 1
+        return results
+
     # 補助：長文を安全に分割して流す（句読点と改行で優先分割しつつ、最大長でフォールバック）
     def _chunk_text(self, text: str, chunk_size: int = 800) -> List[str]:
         import re
@@ -28,7 +28,7 @@ class KnowledgeService:
 
     @staticmethod
     def get(knowledge_id):
-        return Knowledge.query.get(knowledge_id)
+        return db.session.get(Knowledge, knowledge_id)
 
 
     @staticmethod
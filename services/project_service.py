@@ -1,19 +1,62 @@
 # project_service.py
+import threading
+import time
+from dataclasses import dataclass
+from sqlalchemy import select
 from extensions import db
 from models.projects import Projects
 from models.knowledge import Knowledge
 
 
-ALLOWED_THEMES = {
+ALLOWED_THEMES = frozenset({
     # ダーク系は廃止し、ライト3種のみ許可
     "theme-sky", "theme-emerald", "theme-amber",
-}
+})
+
+
+@dataclass(frozen=True)
+class ProjectMeta:
+    """画面表示用のプロジェクト情報（セッションに紐づかないためキャッシュ可能）。"""
+    project_id: int
+    project_name: str
+    theme: str
+    doc_path: str | None
 
 
 class ProjectService(object):
+    # fetch_meta のキャッシュ（project_id -> (取得時刻, ProjectMeta)）。更新・削除時に破棄する
+    META_CACHE_TTL = 60.0
+    _meta_cache: dict[int, tuple[float, ProjectMeta]] = {}
+    _meta_lock = threading.Lock()
+
     def __init__(self):
         pass
 
+    # 追加: 表示用メタ情報を短時間キャッシュ付きで取得
+    def fetch_meta(self, project_id: int) -> ProjectMeta | None:
+        now = time.monotonic()
+        with self._meta_lock:
+            hit = self._meta_cache.get(project_id)
+        if hit is not None and now - hit[0] < self.META_CACHE_TTL:
+            return hit[1]
+        proj = self.fetch_by_id(project_id)
+        if not proj:
+            return None
+        meta = ProjectMeta(
+            project_id=proj.project_id,
+            project_name=proj.project_name,
+            theme=getattr(proj, 'theme', None) or 'theme-sky',
+            doc_path=proj.doc_path,
+        )
+        with self._meta_lock:
+            self._meta_cache[project_id] = (now, meta)
+        return meta
+
+    @classmethod
+    def _invalidate_meta(cls, project_id: int) -> None:
+        with cls._meta_lock:
+            cls._meta_cache.pop(project_id, None)
+
     def create_project(self, project_name: str, description: str, doc_path: str) -> Projects:
         project = Projects(project_name=project_name, description=description, doc_path=doc_path)
         db.session.add(project)
@@ -21,26 +64,28 @@ class ProjectService(object):
         return project
 
     def fetch_all_projects(self):
-        return Projects.query.order_by(Projects.project_id.desc()).all()
+        stmt = select(Projects).order_by(Projects.project_id.desc())
+        return db.session.execute(stmt).scalars().all()
 
     # 追加：ID 取得
     def fetch_by_id(self, project_id: int) -> Projects | None:
-        return Projects.query.get(project_id)
+        return db.session.get(Projects, project_id)
 
     # 追加：更新
     def update_project(self, project_id: int, project_name: str, description: str, doc_path: str) -> Projects:
-        project = Projects.query.get(project_id)
+        project = db.session.get(Projects, project_id)
         if not project:
             return None
         project.project_name = project_name
         project.description  = description
         project.doc_path     = doc_path
         db.session.commit()
+        self._invalidate_meta(project_id)
         return project
 
     @staticmethod
     def duplicate_project(project_id: int, new_name: str) -> Projects:
-        original_project = Projects.query.get(project_id)
+        original_project = db.session.get(Projects, project_id)
         if not original_project:
             raise ValueError("プロジェクトが見つかりません")
 
@@ -80,12 +125,13 @@ class ProjectService(object):
 
     @staticmethod
     def delete_project(project_id: int) -> None:
-        project = Projects.query.get(project_id)
+        project = db.session.get(Projects, project_id)
         if not project:
             raise ValueError("プロジェクトが見つかりません")
 
         db.session.delete(project)
         db.session.commit()
+        ProjectService._invalidate_meta(project_id)
 
     # 追加: テーマ更新
     def update_theme(self, project_id: int, theme_key: str) -> Projects:
@@ -94,9 +140,11 @@ class ProjectService(object):
             theme_key = 'theme-sky'
         if theme_key not in ALLOWED_THEMES:
             raise ValueError("invalid_theme")
-        proj = Projects.query.get(project_id)
+        proj = db.session.get(Projects, project_id)
         if not proj:
             raise ValueError("project_not_found")
         proj.theme = theme_key
         db.session.commit()
+        self._invalidate_meta(project_id)
         return proj
+
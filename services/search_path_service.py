@@ -1,10 +1,12 @@
 from __future__ import annotations
 
-import json
+import hashlib
 import os
 from pathlib import Path
 from typing import Dict, List, Any, Iterable
 
+import orjson
+
 from services.project_service import ProjectService
 
 
@@ -29,6 +31,8 @@ class SearchPathService:
     """
 
     VERSION = 2
+    # ツリーに出さない（降りない）ディレクトリ名
+    TREE_EXCLUDED_NAMES = frozenset({".git", "vendor", ".github", "logs", "node_modules", ".venv", "__pycache__", ".idea"})
 
     def _instance_dir(self, project_id: int) -> Path:
         base = Path.cwd() / "instance" / str(project_id)
@@ -48,7 +52,7 @@ class SearchPathService:
         if not p.exists():
             return {"version": self.VERSION, "includes": [], "excludes": sorted(list(REQUIRED_EXCLUDES))}
         try:
-            data = json.loads(p.read_text(encoding="utf-8"))
+            data = orjson.loads(p.read_bytes())
             inc = data.get("includes") or []
             exc = data.get("excludes") or []
             if not isinstance(inc, list) or not isinstance(exc, list):
@@ -85,7 +89,7 @@ class SearchPathService:
         .git / vendor / .github / logs / node_modules / .venv / __pycache__ / .idea は除外。
         存在しないパスは無視。
         """
-        EXCLUDED_NAMES = {".git", "vendor", ".github", "logs", "node_modules", ".venv", "__pycache__", ".idea"}
+        EXCLUDED_NAMES = self.TREE_EXCLUDED_NAMES
         rel = str(rel).replace("\\", "/").strip("/")
         if not rel:
             return []
@@ -152,9 +156,50 @@ class SearchPathService:
             "excludes": exc_final,
         }
         p = self._state_path(project_id)
-        p.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+        p.write_bytes(orjson.dumps(state, option=orjson.OPT_INDENT_2))
         return state
 
+    def _tree_start(self, base: Path, rel: str) -> Path:
+        """build_tree の開始ディレクトリ（doc_path 外・除外ディレクトリ・存在しない場合は base）。"""
+        rel_norm = (rel or "").strip().replace("\\", "/").strip("/")
+        if not rel_norm:
+            return base
+        candidate = (base / rel_norm).resolve()
+        try:
+            parts = candidate.relative_to(base).parts
+        except Exception:
+            return base
+        if any(part in self.TREE_EXCLUDED_NAMES for part in parts):
+            return base
+        if not candidate.exists() or not candidate.is_dir():
+            return base
+        return candidate
+
+    def tree_fingerprint(self, project_id: int, rel: str = "") -> str:
+        """
+        build_tree の結果が変わったかを判定する指紋（ETag 用）。ツリー自体は作らない。
+        開始ディレクトリと直下のディレクトリの mtime（= エントリの追加/削除）と、選択状態ファイルから算出する。
+        """
+        base = self._doc_base(project_id)
+        start = self._tree_start(base, rel)
+        h = hashlib.sha1(f"{base}\0{start}\0".encode("utf-8"))
+        try:
+            st = self._state_path(project_id).stat()
+            h.update(f"state\0{st.st_mtime_ns}\0{st.st_size}\0".encode("utf-8"))
+        except OSError:
+            h.update(b"state\0-\0")
+        try:
+            h.update(f"{start.stat().st_mtime_ns}\0".encode("utf-8"))
+            with os.scandir(start) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        # 子ディレクトリの mtime は has_children の変化を拾うため
+                        mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+                        h.update(f"{entry.name}\0{mtime}\0".encode("utf-8", errors="surrogateescape"))
+        except OSError:
+            h.update(b"-\0")
+        return h.hexdigest()
+
     def build_tree(self, project_id: int, rel: str = "") -> List[Dict[str, Any]]:
         """
         doc_path 配下の "直下1階層のみ" を返す（Lazy Load 用）。
@@ -194,19 +239,7 @@ class SearchPathService:
             # v1: includes にディレクトリが含まれている想定 — 祖先一致で採用
             return any(rel_file == i or rel_file.startswith(i + "/") for i in inc_list)
 
-        # 開始ディレクトリを決定
-        start = base
-        rel_norm = (rel or "").strip().replace("\\", "/").strip("/")
-        if rel_norm:
-            candidate = (base / rel_norm).resolve()
-            try:
-                candidate.relative_to(base)
-            except Exception:
-                candidate = base
-            start = base if is_excluded_path(candidate) else candidate
-
-        if not start.exists() or not start.is_dir():
-            start = base
+        start = self._tree_start(base, rel)
 
         dirs: List[Dict[str, Any]] = []
         files: List[Dict[str, Any]] = []
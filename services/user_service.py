@@ -1,12 +1,53 @@
+import threading
+import time
+
+from sqlalchemy import exists, select
+
 from models.users import Users, db
 
 class UserService:
+    # 登録フォームの重複チェック結果のキャッシュ（(列名, 値) -> (取得時刻, 使用済みか)）
+    TAKEN_CACHE_TTL = 30.0
+    TAKEN_CACHE_MAX = 1024
+    _taken_cache: dict[tuple[str, str], tuple[float, bool]] = {}
+    _taken_lock = threading.Lock()
+
+    @classmethod
+    def _is_taken(cls, column: str, value: str) -> bool:
+        key = (column, value)
+        now = time.monotonic()
+        with cls._taken_lock:
+            hit = cls._taken_cache.get(key)
+        if hit is not None and now - hit[0] < cls.TAKEN_CACHE_TTL:
+            return hit[1]
+        taken = bool(db.session.scalar(select(exists().where(getattr(Users, column) == value))))
+        with cls._taken_lock:
+            if len(cls._taken_cache) >= cls.TAKEN_CACHE_MAX:
+                cls._taken_cache.clear()
+            cls._taken_cache[key] = (now, taken)
+        return taken
+
+    @classmethod
+    def _invalidate_taken(cls, username, email) -> None:
+        with cls._taken_lock:
+            cls._taken_cache.pop(("username", username), None)
+            cls._taken_cache.pop(("email", email), None)
+
+    @staticmethod
+    def username_taken(username) -> bool:
+        return UserService._is_taken("username", username)
+
+    @staticmethod
+    def email_taken(email) -> bool:
+        return UserService._is_taken("email", email)
+
     @staticmethod
     def add_user(username, email, password):
         user = Users(username=username, email=email)
         user.set_password(password)
         db.session.add(user)
         db.session.commit()
+        UserService._invalidate_taken(username, email)
 
     @staticmethod
     def get_user_by_username(username):
@@ -14,11 +55,12 @@ class UserService:
 
     @staticmethod
     def delete_user(user_id):
-        user = Users.query.get(user_id)
+        user = db.session.get(Users, user_id)
         if user:
             db.session.delete(user)
             db.session.commit()
+            UserService._invalidate_taken(user.username, user.email)
 
     @staticmethod
     def get_all_users():
-        return Users.query.all()
\ No newline at end of file
+        return Users.query.all()